@@ -1,6 +1,6 @@
 import sys
 
-from .commands import help, PLUGINS
+from .commands import PLUGINS
 
 
 def match_command(which):
@@ -8,7 +8,7 @@ def match_command(which):
         if name == which:
             return func
     sys.stderr.write("\nCan't find command '%s'.\n" % which)
-    return help.cmd
+    return PLUGINS['help']
 
 
 def main(argv = None):
@@ -19,12 +19,12 @@ def main(argv = None):
     except KeyboardInterrupt:
         sys.exit(0)
     except:
-        cmd = help.cmd
+        cmd = PLUGINS['help']
     try:
         cmd(*argv[2:])
     except SyntaxWarning:
         sys.stderr.write('\nBad command-line syntax.\n')
-        help.cmd()
+        PLUGINS['help']()
         sys.exit(1)
 
 
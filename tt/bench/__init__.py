@@ -0,0 +1,10 @@
+"""
+Benchmarks for tt. Generate synthetic terms wikis as real local git repos, time
+each stage of building a glossary from them, and compare against a baseline:
+
+    python -m tt.bench --pages 2000 --out results.json --baseline baseline.json
+
+With --baseline alone, results are compared to baseline.json, which is saved
+beside the suite and holds a run with the default parameters. Re-record it with
+--out when the suite or the default parameters change. Everything runs offline.
+"""
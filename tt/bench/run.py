@@ -0,0 +1,143 @@
+"""
+Time each stage of building a glossary from synthetic terms wikis.
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+from .. import cache
+from .. import markdown
+from .. import tw
+from ..glossary import Glossary
+from . import synth
+
+STAGES = ['pages', 'parse', 'split', 'tags', 'tags_cached', 'history', 'fix_hyperlinks', 'render']
+# Results of a run with the default parameters, to compare against.
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+# A stage has to be this much slower than its baseline before it's flagged...
+DEFAULT_THRESHOLD = 0.25
+# ...and slower by at least this many seconds, so timer noise in tiny stages is ignored.
+MIN_SLOWDOWN = 0.005
+
+
+def _timed(func):
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def run_once(root, params):
+    """
+    Build a fresh synthetic wiki under root and time every stage once. Return a
+    dict of stage -> seconds.
+    """
+    tw.LOCAL_PATH = os.path.join(root, 'corpus')
+    cache.CACHE_PATH = os.path.join(root, 'cache')
+    name = 'bench-terms'
+    wiki = tw.TermsWiki(name)
+    remote = os.path.join(root, wiki.repo_name + '.git')
+    synth.make_wiki(remote, **params)
+    # The clone stands in for one from github; refreshing it pulls from the local remote.
+    synth.clone_wiki(remote, wiki.folder)
+
+    times = {}
+    pages = []
+    times['pages'] = _timed(lambda: pages.extend(wiki.pages))
+
+    texts = []
+    for page in pages:
+        with open(page.path, 'rt') as f:
+            texts.append(f.read())
+    asts = []
+    times['parse'] = _timed(lambda: asts.extend(markdown.parse(t) for t in texts))
+    times['split'] = _timed(lambda: [markdown.split(a) for a in asts])
+
+    # Cold: every page has to be parsed to find its tags.
+    times['tags'] = _timed(lambda: [p.tags for p in pages])
+    wiki.cache.save()
+    # Warm: a new wiki object reads everything from the page cache.
+    warm = tw.TermsWiki(name)
+    warm.refreshed = True
+    warm_pages = list(warm.walk())
+    times['tags_cached'] = _timed(lambda: [p.tags for p in warm_pages])
+    times['history'] = _timed(lambda: [p.history for p in warm_pages])
+
+    g = Glossary({'sources': [{'wiki': name}]})
+    g.pages
+    err, sys.stderr = sys.stderr, io.StringIO()
+    try:
+        times['fix_hyperlinks'] = _timed(lambda: [g.fix_hyperlinks(p) for p in g.pages])
+        times['render'] = _timed(lambda: g.render_to(io.StringIO()))
+    finally:
+        sys.stderr = err
+    return times
+
+
+def run(params, repeat=1):
+    """
+    Time every stage repeat times, each against a freshly generated wiki, and
+    keep the best time for each stage.
+    """
+    old_paths = tw.LOCAL_PATH, cache.CACHE_PATH
+    best = {}
+    try:
+        for i in range(repeat):
+            with tempfile.TemporaryDirectory() as root:
+                for stage, seconds in run_once(root, params).items():
+                    best[stage] = min(seconds, best.get(stage, seconds))
+    finally:
+        tw.LOCAL_PATH, cache.CACHE_PATH = old_paths
+    return {'params': params, 'stages': best}
+
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """
+    Return (stage, baseline seconds, current seconds) for each stage that got
+    more than threshold slower than in baseline.
+    """
+    slower = []
+    for stage, seconds in results['stages'].items():
+        before = baseline['stages'].get(stage)
+        if before and seconds > before * (1 + threshold) and seconds - before > MIN_SLOWDOWN:
+            slower.append((stage, before, seconds))
+    return slower
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(prog='python -m tt.bench', description='Benchmark tt on synthetic terms wikis.')
+    p.add_argument('--pages', type=int, default=500)
+    p.add_argument('--tags', type=int, default=50, help='distinct tags in the wiki')
+    p.add_argument('--links', type=int, default=5, help='links per page')
+    p.add_argument('--commits', type=int, default=3, help='commits per page')
+    p.add_argument('--repeat', type=int, default=3, help='runs per stage; the best time is kept')
+    p.add_argument('--seed', type=int, default=0)
+    p.add_argument('--out', help='save results to this json file')
+    p.add_argument('--baseline', nargs='?', const=BASELINE_PATH,
+                   help='compare results to this json file (by default, the one saved with the suite)')
+    p.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                   help='fraction by which a stage may be slower than baseline')
+    args = p.parse_args(argv)
+
+    params = {'pages': args.pages, 'tags': args.tags, 'links': args.links,
+              'commits': args.commits, 'seed': args.seed}
+    results = run(params, args.repeat)
+    for stage in STAGES:
+        print('%-16s %9.1f ms' % (stage, results['stages'][stage] * 1000))
+    if args.out:
+        with open(args.out, 'wt') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, 'rt') as f:
+            baseline = json.load(f)
+        if baseline.get('params') != params:
+            sys.stderr.write('Warning: baseline was measured with different parameters.\n')
+        slower = compare(results, baseline, args.threshold)
+        for stage, before, after in slower:
+            sys.stderr.write('%s got slower: %.1f ms -> %.1f ms\n' % (stage, before * 1000, after * 1000))
+        return 1 if slower else 0
+    return 0
@@ -0,0 +1,95 @@
+"""
+Generate synthetic terms wikis with a configurable number of pages, tags, links
+per page and commits per page.
+"""
+import random
+import subprocess
+
+from ..markdown import title_to_fragment
+
+SYLLABLES = ['ca', 'de', 'fi', 'go', 'hu', 'ja', 'ke', 'li', 'mo', 'nu', 'pa', 're', 'si', 'to', 'vu', 'xe', 'zo']
+AUTHORS = ['Alice', 'Bob', 'Carol', 'Dave', 'Erin', 'Frank']
+# Mid 2021, roughly when terms wikis started.
+START_TIME = 1625000000
+
+
+def _word(r):
+    return ''.join(r.choice(SYLLABLES) for i in range(r.randint(2, 4)))
+
+
+def make_terms(count, r):
+    """
+    Return count distinct multi-word terms, some with acronyms.
+    """
+    terms = set()
+    while len(terms) < count:
+        words = [_word(r) for i in range(r.randint(1, 3))]
+        term = ' '.join(words)
+        if len(words) > 1 and r.random() < 0.2:
+            term += ' (%s)' % ''.join(w[0] for w in words).upper()
+        terms.add(term)
+    return sorted(terms)
+
+
+def make_page(term, terms, tags, links, revision, r):
+    # A page never links to itself, which would make link resolution look cheaper.
+    candidates = [t for t in terms if t != term]
+    others = r.sample(candidates, min(links, len(candidates)))
+    sentences = ['%s is a %s that relates to [%s](%s).' % (term.capitalize(), _word(r), t, title_to_fragment(t))
+                 for t in others]
+    return '\n'.join([
+        '## Definition',
+        ' '.join(sentences) or '%s is a %s.' % (term.capitalize(), _word(r)),
+        '',
+        '## Notes',
+        '* Revised in revision %d.' % revision,
+        '* %s %s %s.' % (_word(r), _word(r), _word(r)),
+        '',
+        '## Tags',
+        ' '.join(r.sample(tags, min(3, len(tags)))),
+        '',
+    ])
+
+
+def make_wiki(remote, pages=100, tags=20, links=3, commits=2, seed=0):
+    """
+    Create a bare git repo at remote that looks like a terms wiki. It holds pages
+    term pages (plus a Home page), tagged from a pool of tags distinct tags, each
+    linking to links other pages and each changed in commits commits. The history
+    is written with a single git fast-import, so even big wikis are quick to make.
+    Return the list of terms.
+    """
+    r = random.Random(seed)
+    terms = make_terms(pages, r)
+    tag_pool = ['#tag-%s' % _word(r) for i in range(tags)]
+    fnames = [t.replace(' ', '-') + '.md' for t in terms]
+
+    stream = []
+
+    def data(text):
+        b = text.encode('utf-8')
+        stream.append(b'data %d\n' % len(b))
+        stream.append(b + b'\n')
+
+    for revision in range(max(1, commits)):
+        author = AUTHORS[revision % len(AUTHORS)]
+        when = START_TIME + revision * 86400
+        stream.append(b'commit refs/heads/main\n')
+        stream.append(('author %s <%s@example.com> %d +0000\n' % (author, author.lower(), when)).encode('utf-8'))
+        stream.append(('committer %s <%s@example.com> %d +0000\n' % (author, author.lower(), when)).encode('utf-8'))
+        data('Revision %d' % revision)
+        if revision == 0:
+            stream.append(b'M 100644 inline Home.md\n')
+            data('Welcome to a synthetic terms wiki.\n')
+        for term, fname in zip(terms, fnames):
+            stream.append(('M 100644 inline %s\n' % fname).encode('utf-8'))
+            data(make_page(term, terms, tag_pool, links, revision, r))
+        stream.append(b'\n')
+
+    subprocess.run(['git', 'init', '-q', '--bare', '-b', 'main', remote], check=True)
+    subprocess.run(['git', '-C', remote, 'fast-import', '--quiet'], input=b''.join(stream), check=True)
+    return terms
+
+
+def clone_wiki(remote, folder):
+    subprocess.run(['git', 'clone', '-q', remote, folder], check=True)
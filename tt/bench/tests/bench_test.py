@@ -0,0 +1,40 @@
+import json
+import os
+
+from ... import cache
+from ... import tw
+from .. import run
+from .. import synth
+
+
+def test_make_wiki(tmp_path, monkeypatch):
+    monkeypatch.setattr(tw, 'LOCAL_PATH', str(tmp_path / 'corpus'))
+    monkeypatch.setattr(cache, 'CACHE_PATH', str(tmp_path / 'cache'))
+    wiki = tw.TermsWiki('synth-terms')
+    remote = str(tmp_path / 'synth-terms.wiki.git')
+    terms = synth.make_wiki(remote, pages=8, tags=4, links=2, commits=3)
+    synth.clone_wiki(remote, wiki.folder)
+    pages = [p for p in wiki.pages if p.is_term]
+    assert sorted(p.term for p in pages) == terms
+    for page in pages:
+        assert page.version == 3
+        assert len(page.links) == 2
+        assert page.fragment not in page.links
+        assert len(page.tags) == 4
+
+
+def test_run_times_every_stage():
+    results = run.run({'pages': 5, 'tags': 3, 'links': 1, 'commits': 1, 'seed': 0})
+    assert sorted(results['stages']) == sorted(run.STAGES)
+
+
+def test_baseline_covers_every_stage():
+    with open(run.BASELINE_PATH, 'rt') as f:
+        baseline = json.load(f)
+    assert sorted(baseline['stages']) == sorted(run.STAGES)
+
+
+def test_compare_flags_slow_stages():
+    baseline = {'stages': {'parse': 1.0, 'render': 1.0, 'split': 0.001}}
+    results = {'stages': {'parse': 1.1, 'render': 2.0, 'split': 0.002}}
+    assert run.compare(results, baseline) == [('render', 1.0, 2.0)]
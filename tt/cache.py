@@ -0,0 +1,70 @@
+"""
+Persistent cache of the data extracted from terms wiki pages, so pages that
+haven't changed since the last run don't have to be parsed again.
+"""
+import json
+import os
+
+CACHE_PATH = os.path.normpath(os.path.expanduser('~/.tt/cache'))
+# Bump this whenever the shape of cached page data changes.
+CACHE_VERSION = 2
+
+
+def file_key(path):
+    """
+    Return a cheap fingerprint of a file's content, based on its mtime and size.
+    """
+    st = os.stat(path)
+    return '%d:%d' % (st.st_mtime_ns, st.st_size)
+
+
+class PageCache:
+    """
+    Cached page data for one wiki, stored in a single json file and keyed by
+    each page's path relative to the root of the wiki.
+    """
+    def __init__(self, name):
+        self.path = os.path.join(CACHE_PATH, name + '.json')
+        self._entries = None
+        self.dirty = False
+
+    @property
+    def entries(self):
+        if self._entries is None:
+            self._entries = {}
+            try:
+                with open(self.path, 'rt') as f:
+                    saved = json.load(f)
+                if saved.get('version') == CACHE_VERSION:
+                    self._entries = saved['pages']
+            except (OSError, ValueError, KeyError):
+                pass
+        return self._entries
+
+    def get(self, rel_path, key):
+        entry = self.entries.get(rel_path)
+        if entry and entry['key'] == key:
+            return entry['data']
+
+    def put(self, rel_path, key, data):
+        self.entries[rel_path] = {'key': key, 'data': data}
+        self.dirty = True
+
+    def prune(self, keep):
+        """
+        Forget every page whose relative path isn't in keep.
+        """
+        for rel_path in [x for x in self.entries if x not in keep]:
+            del self.entries[rel_path]
+            self.dirty = True
+
+    def save(self):
+        if self.dirty:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp = self.path + '.tmp'
+            with open(tmp, 'wt') as f:
+                # json.dumps() is much faster than json.dump(), which can't use
+                # the C encoder.
+                f.write(json.dumps({'version': CACHE_VERSION, 'pages': self.entries}))
+            os.replace(tmp, self.path)
+            self.dirty = False
@@ -1,18 +1,60 @@
+import ast
+import os
+
+_MY_FOLDER = os.path.dirname(os.path.abspath(__file__))
+
+
+class LazyCommand:
+    """
+    A command whose module isn't imported until the command runs. Its name and
+    docstring are read from the source without importing it, so listing commands
+    (as help does) doesn't pay for every command's dependencies.
+    """
+    def __init__(self, name, doc):
+        self.name = name
+        self.__doc__ = doc
+        self._cmd = None
+
+    def load(self):
+        if self._cmd is None:
+            import importlib
+            module = importlib.import_module(f'.{self.name}', __name__)
+            self._cmd = getattr(module, 'cmd')
+        return self._cmd
+
+    def __call__(self, *args):
+        return self.load()(*args)
+
+
+def _read_cmd_doc(path):
+    """
+    Return the docstring of the module-level cmd() function in the python file
+    at path, or None if the file doesn't define one.
+    """
+    with open(path, 'rb') as f:
+        tree = ast.parse(f.read(), path)
+    for node in tree.body:
+        if isinstance(node, ast.FunctionDef) and node.name == 'cmd':
+            # Not ast.get_docstring(), which would import inspect just to tidy
+            # up whitespace that help strips anyway.
+            first = node.body[0]
+            if isinstance(first, ast.Expr) and isinstance(first.value, ast.Constant) \
+                    and isinstance(first.value.value, str):
+                return first.value.value.strip()
+            return ''
+
+
 def _load_plugins():
     """
-    Dynamically discover any commands supported by the tt program.
+    Discover any commands supported by the tt program, by scanning the source of
+    the modules in this folder instead of importing them.
     """
     plugins = {}
-    import importlib
-    import os
-    my_folder = os.path.dirname(os.path.abspath(__file__))
-    for item in os.listdir(my_folder):
-        if item.endswith('.py') and item[0] not in '_.' and item != 'help.py':
-            item = item[:-3]
-            module = importlib.import_module(f'.{item}', __name__)
-            cmd = getattr(module, 'cmd')
-            if cmd:
-                plugins[item] = cmd
+    for item in sorted(os.listdir(_MY_FOLDER)):
+        if item.endswith('.py') and item[0] not in '_.':
+            doc = _read_cmd_doc(os.path.join(_MY_FOLDER, item))
+            if doc is not None:
+                plugins[item[:-3]] = LazyCommand(item[:-3], doc)
     return plugins
 
 
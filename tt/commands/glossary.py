@@ -1,27 +1,166 @@
 import json
+import os
 import sys
+import time
+
+# How often --watch looks for changed pages, in seconds.
+WATCH_INTERVAL = 0.5
 
 
 def cmd(*args):
     """
-    def.json [fname.html] - export glossary data
+    [--jobs N] [--offline] [--profile[=fname.json]] [--watch | --at rev] def.json [fname] - export glossary data, parsing pages in N processes; with --watch, rebuild fname.html whenever a page changes; with --at, read every wiki as of a tag or commit, straight from git. --timeline[=pattern] def.json [folder] writes folder/tag.html for every tag (or those matching pattern, like v*) of the first source, and shows what changed between them. --many def.json more.json... builds several configs at once, reading each wiki only once, and writes each to its "output" or beside it as .html
     """
+    args = list(args)
+    jobs = 1
+    at = None
+    profile = None
+    timeline = None
+    offline = '--offline' in args
+    if offline:
+        args.remove('--offline')
+    watch = '--watch' in args
+    if watch:
+        args.remove('--watch')
+    many = '--many' in args
+    if many:
+        args.remove('--many')
+    for arg in args:
+        if arg == '--profile' or arg.startswith('--profile='):
+            profile = arg[len('--profile='):] or '-'
+            args.remove(arg)
+            break
+    for arg in args:
+        if arg == '--timeline' or arg.startswith('--timeline='):
+            timeline = arg[len('--timeline='):] or '*'
+            args.remove(arg)
+            break
     try:
+        if '--jobs' in args:
+            i = args.index('--jobs')
+            jobs = int(args[i + 1])
+            del args[i:i + 2]
+        if '--at' in args:
+            i = args.index('--at')
+            at = args[i + 1]
+            del args[i:i + 2]
         defs = args[0]
     except:
         raise SyntaxWarning()
+    if timeline:
+        if watch or many or at or len(args) > 2:
+            raise SyntaxWarning()
+        return _build_timeline(defs, args[1] if len(args) > 1 else '.', timeline, jobs, offline, profile)
+    if many:
+        if watch or not all(arg.endswith('.json') for arg in args):
+            raise SyntaxWarning()
+        return _build_many(args, jobs, offline, profile, at)
+    if len(args) > 2 or (watch and (at or len(args) < 2)):
+        raise SyntaxWarning()
     with open(defs, 'rt') as f:
         cfg = json.load(f)
 
     from ..glossary import Glossary
+    from .. import timing
 
-    g = Glossary(cfg)
+    if profile:
+        timing.enable()
+    g = Glossary(cfg, jobs=jobs, offline=offline, at=at)
+    if watch:
+        g.watch_files()
     if len(args) > 1:
         out = open(args[1], 'wt')
     else:
         out = sys.stdout
     try:
-        out.write(g.render())
+        g.render_to(out)
     finally:
         if out != sys.stdout:
             out.close()
+    _report(profile)
+    if watch:
+        _watch(g, args[1])
+
+
+def _build_many(fnames, jobs, offline, profile, at):
+    from ..glossary import Glossary, refresh_wikis
+    from .. import timing
+
+    if profile:
+        timing.enable()
+    # Every glossary gets the same wikis, so a wiki that several of them use is
+    # only pulled and parsed once.
+    wikis = {}
+    builds = []
+    for fname in fnames:
+        with open(fname, 'rt') as f:
+            cfg = json.load(f)
+        out = cfg.get('output') or os.path.splitext(fname)[0] + '.html'
+        builds.append((Glossary(cfg, jobs=jobs, offline=offline, wikis=wikis, at=at), out))
+    refresh_wikis(wikis.values())
+    for g, out in builds:
+        with open(out, 'wt') as f:
+            g.render_to(f)
+        sys.stderr.write('Wrote %s.\n' % out)
+    _report(profile)
+
+
+def _build_timeline(defs, folder, pattern, jobs, offline, profile):
+    from ..glossary import build_timeline, diff_terms
+    from .. import timing
+
+    with open(defs, 'rt') as f:
+        cfg = json.load(f)
+    if profile:
+        timing.enable()
+    os.makedirs(folder, exist_ok=True)
+    previous = None
+    for tag, g in build_timeline(cfg, pattern, jobs=jobs, offline=offline):
+        fname = os.path.join(folder, tag.replace('/', '-') + '.html')
+        with open(fname, 'wt') as out:
+            g.render_to(out)
+        if previous is None:
+            print('%s: %d terms' % (tag, len(g.pages)))
+        else:
+            added, removed, changed = diff_terms(previous, g.pages)
+            print('%s: %d terms, +%d -%d ~%d' % (tag, len(g.pages), len(added), len(removed), len(changed)))
+            for sign, fragments in (('+', added), ('-', removed), ('~', changed)):
+                for fragment in fragments:
+                    print('  %s %s' % (sign, fragment))
+        previous = g.pages
+    if previous is None:
+        sys.stderr.write('No tags to build.\n')
+    _report(profile)
+
+
+def _report(profile):
+    from .. import timing
+
+    if profile == '-':
+        sys.stderr.write(timing.format_report(timing.report()))
+    elif profile:
+        timing.write_report(profile)
+
+
+def _watch(g, fname):
+    sys.stderr.write('Watching %s for changes; press Ctrl+C to stop.\n' % ', '.join(
+        sorted(set(source.wiki.folder for source in g.sources))))
+    try:
+        while True:
+            time.sleep(WATCH_INTERVAL)
+            start = time.perf_counter()
+            try:
+                changed = g.update()
+                if changed:
+                    # Write a new file and swap it in, so nothing ever sees half a glossary.
+                    tmp = fname + '.tmp'
+                    with open(tmp, 'wt') as out:
+                        g.render_to(out)
+                    os.replace(tmp, fname)
+                    sys.stderr.write('%d page(s) changed; rewrote %s in %d ms.\n' % (
+                        changed, fname, (time.perf_counter() - start) * 1000))
+            except Exception as e:
+                # Files can come and go mid-edit; try again next time round.
+                sys.stderr.write("Couldn't rebuild %s: %s\n" % (fname, e))
+    except KeyboardInterrupt:
+        pass
@@ -12,13 +12,9 @@ tt -- Term Tool: manage terminology in CTWG process
 
 Available commands
 """)
-    # To avoid a circular import problem, we didn't load the help plugin dynamically.
-    # Add it manually.
-    if 'help' not in PLUGINS.keys():
-        PLUGINS['help'] = cmd
     for name, func in PLUGINS.items():
         doc = func.__doc__.strip()
-        i = doc.find('-')
-        syntax, doc = doc[:i].rstrip(), doc[i+1:].lstrip()
+        i = doc.find(' - ')
+        syntax, doc = doc[:i].rstrip(), doc[i+3:].lstrip()
         print("  tt %s %s\n      %s\n" % (name, syntax, doc))
 
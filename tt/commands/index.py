@@ -0,0 +1,19 @@
+import sys
+
+
+def cmd(*args):
+    """
+    [wiki ...] - record the term pages of all cloned wikis (or just the ones named), so glossaries can skip parsing them
+    """
+    from .. import tw
+
+    wikis = tw.cloned_wikis()
+    if args:
+        wanted = [tw.TermsWiki(a).repo_name for a in args]
+        missing = [a for a, name in zip(args, wanted) if name not in [w.repo_name for w in wikis]]
+        if missing:
+            sys.stderr.write('\nNot cloned: %s\n' % ', '.join(missing))
+            sys.exit(1)
+        wikis = [w for w in wikis if w.repo_name in wanted]
+    for w in wikis:
+        print('%s\t%d terms' % (w.repo_name, w.write_manifest()))
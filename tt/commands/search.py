@@ -0,0 +1,41 @@
+import sys
+
+
+def cmd(*args):
+    """
+    [--tags expr] [--limit N] query - find the terms in all cloned wikis whose text best matches a query
+    """
+    args = list(args)
+    subset = None
+    limit = 20
+    try:
+        if '--tags' in args:
+            i = args.index('--tags')
+            subset = args[i + 1]
+            del args[i:i + 2]
+        if '--limit' in args:
+            i = args.index('--limit')
+            limit = int(args[i + 1])
+            del args[i:i + 2]
+    except:
+        raise SyntaxWarning()
+    if not args:
+        raise SyntaxWarning()
+
+    from .. import search
+    from .. import tagsel
+    from .. import tw
+
+    if subset:
+        try:
+            subset = tagsel.parse(subset)
+        except tagsel.BadExpression as e:
+            sys.stderr.write('\n%s\n' % e)
+            sys.exit(1)
+    idx = search.SearchIndex()
+    try:
+        idx.update(tw.cloned_wikis())
+        for hit in idx.search(' '.join(args), subset, limit):
+            print('%s\t%s\t%s\t%s' % (hit.wiki, hit.fragment, hit.term, hit.snippet))
+    finally:
+        idx.close()
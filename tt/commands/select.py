@@ -0,0 +1,29 @@
+import sys
+
+
+def cmd(*args):
+    """
+    expr - list the terms in all cloned wikis whose tags match a tag expression
+    """
+    if not args:
+        raise SyntaxWarning()
+
+    from .. import tagindex
+    from .. import tagsel
+    from .. import tw
+
+    try:
+        expr = tagsel.parse(' '.join(args))
+    except tagsel.BadExpression as e:
+        sys.stderr.write('\n%s\n' % e)
+        sys.exit(1)
+    idx = tagindex.load()
+    if idx.update(tw.cloned_wikis()):
+        idx.save()
+    for t in tagsel.expr_tags(expr):
+        if t not in idx.tags:
+            suggestions = idx.suggest(t)
+            sys.stderr.write('No page is tagged %s.%s\n' % (
+                t, (' Did you mean %s?' % ' or '.join(suggestions)) if suggestions else ''))
+    for entry in idx.select(expr):
+        print('%s\t%s\t%s' % (entry.wiki, entry.fragment, entry.term))
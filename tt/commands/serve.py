@@ -0,0 +1,34 @@
+import json
+import sys
+
+
+def cmd(*args):
+    """
+    [--port N] def.json - serve a glossary on http://localhost:N/ (8000 by default), re-reading pages as their files change
+    """
+    args = list(args)
+    try:
+        port = None
+        if '--port' in args:
+            i = args.index('--port')
+            port = int(args[i + 1])
+            del args[i:i + 2]
+        defs = args[0]
+    except:
+        raise SyntaxWarning()
+    with open(defs, 'rt') as f:
+        cfg = json.load(f)
+
+    from ..glossary import Glossary
+    from .. import server
+
+    g = Glossary(cfg)
+    g.watch_files()
+    httpd = server.GlossaryServer(g, ('127.0.0.1', port or server.DEFAULT_PORT))
+    sys.stderr.write('Serving %s on http://localhost:%d/; press Ctrl+C to stop.\n' % (defs, httpd.server_address[1]))
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
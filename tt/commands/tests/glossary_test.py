@@ -0,0 +1,43 @@
+import json
+import pytest
+
+from .. import glossary
+from ... import glossary as tt_glossary
+
+
+class FakeGlossary:
+    def __init__(self, cfg, **kwargs):
+        self.cfg = cfg
+
+    def render_to(self, out):
+        out.write('<dl>%s</dl>' % self.cfg['title'])
+
+
+@pytest.fixture
+def defs(tmp_path, monkeypatch):
+    monkeypatch.setattr(tt_glossary, 'Glossary', FakeGlossary)
+    built = []
+    monkeypatch.setattr(glossary, '_build_many', lambda fnames, *args: built.append(fnames))
+    fname = str(tmp_path / 'def.json')
+    with open(fname, 'wt') as f:
+        json.dump({'title': 'Local', 'sources': []}, f)
+    return fname, built
+
+
+def test_output_can_be_json(defs, tmp_path):
+    fname, built = defs
+    out = str(tmp_path / 'out.json')
+    glossary.cmd(fname, out)
+    with open(out, 'rt') as f:
+        assert f.read() == '<dl>Local</dl>'
+    assert not built
+
+
+def test_many_configs(defs):
+    fname, built = defs
+    glossary.cmd('--many', fname, 'more.json')
+    assert built == [[fname, 'more.json']]
+    with pytest.raises(SyntaxWarning):
+        glossary.cmd('--many', fname, 'out.html')
+    with pytest.raises(SyntaxWarning):
+        glossary.cmd(fname, 'more.json', 'out.html')
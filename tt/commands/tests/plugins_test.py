@@ -0,0 +1,22 @@
+import os
+import subprocess
+import sys
+
+from .. import PLUGINS
+from ...app import match_command
+
+PACKAGE_FOLDER = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+
+def test_commands_are_discovered_with_their_docs():
+    assert {'glossary', 'help', 'select'} <= set(PLUGINS)
+    assert ' - ' in PLUGINS['select'].__doc__
+    assert match_command('help') is PLUGINS['help']
+
+
+def test_listing_commands_imports_none_of_them():
+    code = ("import sys; from tt.app import main; main(['tt', 'help']); "
+            "print(sorted(m for m in sys.modules if m.startswith('tt.commands.')))")
+    out = subprocess.check_output([sys.executable, '-c', code], cwd=PACKAGE_FOLDER, text=True)
+    assert "Can't find" not in out
+    assert out.strip().splitlines()[-1] == "['tt.commands.help']"
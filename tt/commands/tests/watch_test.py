@@ -0,0 +1,32 @@
+from .. import glossary
+
+
+class FlakyGlossary:
+    def __init__(self):
+        self.updates = 0
+
+    def update(self):
+        self.updates += 1
+        if self.updates == 1:
+            raise FileNotFoundError('alpha.md')
+        if self.updates == 3:
+            raise KeyboardInterrupt()
+        return 1
+
+    def render_to(self, out):
+        out.write('<dl></dl>')
+
+    @property
+    def sources(self):
+        return []
+
+
+def test_watch_survives_errors(tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(glossary, 'WATCH_INTERVAL', 0)
+    fname = str(tmp_path / 'out.html')
+    g = FlakyGlossary()
+    glossary._watch(g, fname)
+    assert g.updates == 3
+    assert "Couldn't rebuild" in capsys.readouterr().err
+    with open(fname, 'rt') as f:
+        assert f.read() == '<dl></dl>'
@@ -1,10 +1,15 @@
 import os
 import re
 import subprocess
+import threading
+
+from . import timing
 
 VERSION_PAT = re.compile(r'.*git\s+version\s+(\d+)[.](\d+)(?:[.](\d+))?\s*')
 GIT_ENV = {'GIT_TERMINAL_PROMPT': '0'}
 SAFE_CWD = os.path.expanduser('~')
+# Each commit starts with a NUL so that commits can be told apart from file names.
+HISTORY_FORMAT = '%x00%h%x1f%an%x1f%at'
 
 
 def is_installed():
@@ -12,56 +17,228 @@ def is_installed():
     return str(proc.stdout) if proc.returncode == 0 else None
 
 
-def run_git(args):
+def run_git(args, cwd=None):
     cmd = ['git'] + args
-    proc = subprocess.run(cmd, env=GIT_ENV, capture_output=True)
+    timing.count('subprocesses')
+    proc = subprocess.run(cmd, env=GIT_ENV, cwd=cwd, capture_output=True)
     if proc.returncode:
         print("Command \"git %s\" failed with exit code %d." % (' '.join(args), proc.returncode))
         raise Exception(proc.stderr.decode('utf-8'))
     return proc
 
 
-def safecwd():
-    try:
-        return os.getcwd()
-    except:
-        # Git won't run if cwd is invalid. Set cwd to something that should always exist.
-        cwd = SAFE_CWD
-        os.chdir(cwd)
-        return cwd
-
+# None of the functions below change the process's cwd, so they're safe to
+# call from several threads at once.
 
-def clone(remote, local):
-    oldcwd = safecwd()
-    os.chdir(SAFE_CWD)
-    try:
-        if os.path.exists(local):
-            raise Exception('Path %s already exists.' % local)
-        run_git(['clone', remote, local])
-    finally:
-        os.chdir(oldcwd)
+def clone(remote, local, filter=None, reference=None):
+    """
+    Clone remote into local. Filter asks for a partial clone (blob:none fetches
+    file contents only when they're checked out or read). Reference names a
+    local repo, such as a mirror on a CI cache, whose objects are borrowed
+    instead of downloaded; it's ignored if it doesn't exist, but once used, it
+    must stay where it is.
+    """
+    if os.path.exists(local):
+        raise Exception('Path %s already exists.' % local)
+    args = ['clone']
+    if filter:
+        args.append('--filter=' + filter)
+    if reference:
+        args += ['--reference-if-able', os.path.abspath(reference)]
+    # Git won't run if cwd is invalid, so run it somewhere that should always exist.
+    run_git(args + [remote, local], cwd=SAFE_CWD)
 
 
 def pull(local):
+    _check_repo(local)
+    run_git(['-C', os.path.abspath(local), 'pull', '--ff-only'], cwd=SAFE_CWD)
+
+
+def fetch(local):
+    """
+    Fetch from origin and move the checked out branch to whatever its upstream
+    now points to. Unlike pull, this never merges, so it still works when the
+    remote's history was rewritten. Local edits are kept, unless they touch
+    files that changed upstream, in which case nothing moves and this raises.
+    """
+    fetch_refs(local)
+    run_git(['-C', os.path.abspath(local), 'reset', '-q', '--keep', '@{upstream}'], cwd=SAFE_CWD)
+
+
+def fetch_refs(local):
+    """
+    Fetch every branch and tag from origin, leaving what's checked out alone.
+    """
+    _check_repo(local)
+    run_git(['-C', os.path.abspath(local), 'fetch', '-q', '--tags', 'origin'], cwd=SAFE_CWD)
+
+
+def remote_head(local):
+    """
+    Ask the remote which commit the upstream of the checked out branch points
+    to, without fetching anything. Return None if no branch is checked out, or
+    it has no upstream, or the upstream branch is gone.
+    """
+    _check_repo(local)
+    local = os.path.abspath(local)
+    proc = run_git(['-C', local, 'for-each-ref', '--format=%(HEAD) %(upstream:remotename) %(upstream:remoteref)',
+                    'refs/heads'], cwd=SAFE_CWD)
+    for line in proc.stdout.decode('utf-8').splitlines():
+        # Other branches' lines start with a space, and are blank if they have
+        # no upstream.
+        if line.startswith('*'):
+            fields = line.split()
+            if len(fields) < 3:
+                return None
+            remote, ref = fields[1], fields[2]
+            proc = run_git(['-C', local, 'ls-remote', remote, ref], cwd=SAFE_CWD)
+            for hash_and_ref in proc.stdout.decode('utf-8').splitlines():
+                hash, name = hash_and_ref.split('\t')
+                if name == ref:
+                    return hash
+            return None
+
+
+def _check_repo(local):
     if not os.path.isdir(os.path.join(local, '.git')):
-        raise Exception('Path %s does not exist or is not a git repo.')
-    oldcwd = os.getcwd()
-    os.chdir(local)
-    try:
-        proc = run_git(['pull', '--ff-only'])
-    finally:
-        os.chdir(oldcwd)
+        raise Exception('Path %s does not exist or is not a git repo.' % local)
+
+
+def get_head(folder):
+    """
+    Return the hash of the commit checked out in a repo, or None if it has none.
+    """
+    return resolve(folder, 'HEAD')
+
+
+def resolve(folder, rev):
+    """
+    Return the full hash of the commit that rev names in a repo, or None if there's
+    no such commit. Unlike run_git, this says nothing when git fails.
+    """
+    timing.count('subprocesses')
+    proc = subprocess.run(['git', '-C', folder, 'rev-parse', '--verify', '-q', rev + '^{commit}'],
+                          env=GIT_ENV, capture_output=True)
+    return proc.stdout.decode('utf-8').strip() if proc.returncode == 0 else None
+
+
+def get_dirty_files(folder):
+    """
+    Return the set of files in a repo's working tree that differ from HEAD:
+    modified, added, deleted or untracked. Paths are relative to the root of
+    the repo, using / as separator.
+    """
+    proc = run_git(['-C', folder, '-c', 'core.quotePath=false', 'status', '--porcelain', '-z',
+                    '--no-renames', '--untracked-files=all'])
+    return set(line[3:] for line in proc.stdout.decode('utf-8').split('\0') if line)
+
+
+def get_changes(folder, old, new):
+    """
+    Return the files that differ between two commits, as a list of (status, path)
+    tuples. Status is A, M or D (renames show up as a D and an A); paths are
+    relative to the root of the repo, using / as separator.
+    """
+    proc = run_git(['-C', folder, '-c', 'core.quotePath=false', 'diff', '--name-status',
+                    '--no-renames', '-z', old, new])
+    fields = proc.stdout.decode('utf-8').split('\0')
+    return [(fields[i][0], fields[i + 1]) for i in range(0, len(fields) - 1, 2)]
+
+
+def list_tags(folder, pattern=None):
+    """
+    Return the names of the tags in a repo, oldest first, optionally just those
+    matching a glob pattern like v*.
+    """
+    proc = run_git(['-C', folder, 'for-each-ref', '--sort=creatordate', '--format=%(refname:short)',
+                    'refs/tags/' + (pattern or '')])
+    return proc.stdout.decode('utf-8').split()
+
+
+def list_blobs(folder, rev):
+    """
+    Return every file in a commit as a list of (path, blob hash) tuples. Paths
+    are relative to the root of the repo, using / as separator.
+    """
+    proc = run_git(['-C', folder, '-c', 'core.quotePath=false', 'ls-tree', '-r', '-z', rev])
+    blobs = []
+    for line in proc.stdout.decode('utf-8').split('\0'):
+        if line:
+            info, path = line.split('\t', 1)
+            mode, kind, hash = info.split(' ')
+            if kind == 'blob':
+                blobs.append((path, hash))
+    return blobs
+
+
+class BlobReader:
+    """
+    Reads blobs out of a repo's object store through a single long-running
+    "git cat-file --batch", so reading thousands of them doesn't cost thousands
+    of processes. Safe to share between threads.
+    """
+    def __init__(self, folder):
+        timing.count('subprocesses')
+        self._proc = subprocess.Popen(['git', '-C', folder, 'cat-file', '--batch'], env=GIT_ENV,
+                                      stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        self._lock = threading.Lock()
+
+    def read(self, hash):
+        """
+        Return the content of a blob, as bytes.
+        """
+        with self._lock:
+            self._proc.stdin.write(hash.encode('ascii') + b'\n')
+            self._proc.stdin.flush()
+            header = self._proc.stdout.readline().split()
+            if len(header) != 3:
+                raise Exception('No object %s in repo.' % hash)
+            data = self._proc.stdout.read(int(header[2]))
+            # Each object is followed by a newline.
+            self._proc.stdout.read(1)
+            return data
+
+    def close(self):
+        if self._proc:
+            self._proc.stdin.close()
+            self._proc.wait()
+            self._proc.stdout.close()
+            self._proc = None
 
 
 def get_history(path):
-    oldcwd = os.getcwd()
+    """
+    Return the history of a single file as a list of (hash, author, timestamp)
+    tuples, newest first.
+    """
     folder, fname = os.path.split(path)
-    os.chdir(folder)
-    try:
-        proc = run_git(['log', "--pretty=%h,%an,%at", fname])
-        return proc.stdout.decode('utf-8').strip().split('\n')
-    finally:
-        os.chdir(oldcwd)
+    proc = run_git(['-C', folder, 'log', '--pretty=format:' + HISTORY_FORMAT, '--', fname])
+    return [_parse_history_event(line) for line in proc.stdout.decode('utf-8').split('\0') if line.strip()]
+
+
+def get_histories(folder, rev=None):
+    """
+    Return the history of every file in a repo (as of rev, or HEAD), gathered
+    with a single "git log" pass. The result maps each path (relative to the root of the repo, using /
+    as separator) to a list of (hash, author, timestamp) tuples, newest first.
+    """
+    proc = run_git(['-C', folder, '-c', 'core.quotePath=false', 'log', '--name-only',
+                    '--pretty=format:' + HISTORY_FORMAT] + ([rev] if rev else []))
+    histories = {}
+    for chunk in proc.stdout.decode('utf-8').split('\0'):
+        lines = chunk.split('\n')
+        if not lines[0]:
+            continue
+        event = _parse_history_event(lines[0])
+        for fname in lines[1:]:
+            if fname:
+                histories.setdefault(fname, []).append(event)
+    return histories
+
+
+def _parse_history_event(line):
+    hash, author, timestamp = line.strip().split('\x1f')
+    return hash, author, int(timestamp)
 
 
 if __name__ == '__main__':
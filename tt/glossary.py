@@ -1,50 +1,125 @@
+import concurrent.futures
 import datetime
 import io
+import os
 import re
 import sys
 
+from . import cache
+from . import httpcache
 from . import tw
 from . import markdown
 from . import tagsel
+from . import timing
+from .tag import BKTree, normalize
 
 
-import os
 with open(os.path.join(os.path.dirname(__file__), 'default.css'), 'rt') as f:
     DEFAULT_CSS = '  <style>\n%s\n  </style>\n' % f.read()
-del os
 
-WIKI_PAGE_LINK_PAT = re.compile(r'[a-z0-9]+(-[a-z0-9]+)*$', re.IGNORECASE)
-SHORT_EXTERNAL_GLOSSARY_LINK_PAT = re.compile(r'([a-z0-9]+(?:-[a-z0-9]+)*)@([a-z0-9]+(?:-[a-z0-9]+)*)$', re.IGNORECASE)
+FRAME_PLACEHOLDER_PAT = re.compile('(%nav|%main)')
+
+# Most of the time spent refreshing a source is waiting on the network, so a
+# handful of threads is plenty.
+MAX_REFRESH_THREADS = 8
+
+
+class RefreshError(Exception):
+    def __init__(self, errors):
+        self.errors = errors
+        Exception.__init__(self, "Couldn't refresh %d source(s):\n%s" % (
+            len(errors), '\n'.join('  %s: %s' % (url, str(e).strip()) for url, e in errors)))
 
 
 class Source:
-    def __init__(self, cfg):
-        self.wiki = tw.TermsWiki(cfg.get('wiki'))
+    def __init__(self, cfg, wikis=None, git_cfg=None, at=None):
+        # A source's own revision and git settings override the glossary's.
+        rev = cfg.get('at', at)
+        self.wiki = tw.TermsWiki(cfg.get('wiki'), rev)
+        if wikis is not None:
+            key = self.wiki.repo_url + ('@' + rev if rev else '')
+            self.wiki = wikis.setdefault(key, self.wiki)
+        self.wiki.configure(dict(git_cfg or {}, **cfg.get('git', {})))
         self.subset = cfg.get('subset', None)
         if self.subset:
             self.subset = tagsel.parse(self.subset)
         self.adopt = cfg.get('adopt', False)
 
 
+def refresh_wikis(wikis, force=False):
+    """
+    Clone or pull several wikis at once, then report any failures together.
+    """
+    # Wikis that share a folder must not be refreshed concurrently.
+    by_folder = {}
+    for wiki in wikis:
+        by_folder.setdefault(wiki.folder, []).append(wiki)
+    errors = []
+    threads = max(1, min(MAX_REFRESH_THREADS, len(by_folder)))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as pool:
+        futures = [(group, pool.submit(_refresh_group, group, force)) for group in by_folder.values()]
+        for group, future in futures:
+            e = future.exception()
+            if e:
+                errors.append((group[0].repo_url, e))
+    if errors:
+        raise RefreshError(errors)
+
+
+def _refresh_group(wikis, force):
+    """
+    Refresh wikis that share a local clone, one at a time. The clone is only
+    pulled once; each wiki pinned to a revision checks that it has that revision.
+    """
+    pulled = False
+    for wiki in wikis:
+        if wiki.rev or not pulled:
+            wiki.refresh(force)
+            pulled = pulled or not wiki.rev
+        else:
+            wiki.refreshed = True
+
+
+def _warn_once(wiki, msg):
+    """
+    Warn about a page in wiki, unless that warning has already been given.
+    """
+    if wiki is None or msg not in wiki.warnings:
+        sys.stderr.write(msg)
+        if wiki is not None:
+            wiki.warnings.add(msg)
+
+
 class Glossary:
-    def __init__(self, cfg):
+    def __init__(self, cfg, jobs=1, offline=False, wikis=None, at=None):
+        """
+        To build several glossaries from overlapping sources, give them all the
+        same wikis dict. It maps repo urls to TermsWikis, so each wiki is only
+        refreshed and parsed once, however many glossaries use it.
+
+        Given at, every source is read as of that revision (see TermsWiki),
+        unless the source names its own with "at".
+        """
         self._title = cfg.get('title')
         self.css = cfg.get('css')
         self.write_meta = cfg.get('write_meta', True)
         self.frame = cfg.get('frame')
         if self.frame:
             if "://" in self.frame:
-                import requests
-                r = requests.get(self.frame)
-                self.frame = r.text
+                # A frame that was checked less than frame_max_age seconds ago
+                # isn't checked again; offline, any cached copy will do.
+                self.frame = httpcache.fetch(self.frame, max_age=cfg.get('frame_max_age', 0), offline=offline)
             else:
                 with open(self.frame, 'rt') as f:
                     self.frame = f.read()
         sources = cfg.get('sources')
         self._sources = []
         for source in sources:
-            self._sources.append(Source(source))
+            self._sources.append(Source(source, wikis, cfg.get('git'), at))
         self._pages = None
+        # The html of each entry, once update() has been called.
+        self._entries = None
+        self.jobs = jobs
 
     @property
     def is_standalone_doc(self):
@@ -58,52 +133,210 @@ class Glossary:
     def sources(self):
         return self._sources
 
+    def refresh(self, force=False):
+        """
+        Clone or pull all sources at once, then report any failures together.
+        """
+        refresh_wikis([source.wiki for source in self._sources], force)
+
     @property
     def pages(self):
         if self._pages is None:
-            self._pages = []
-            for source in self._sources:
-                for page in source.wiki.pages:
-                    if page.is_term:
-                        if (source.subset is None) or source.subset.matches(page.tags):
-                            self._pages.append(page)
-        self._pages.sort(key=lambda p: p.fragment)
+            with timing.stage('Glossary.pages'):
+                self._build_pages()
         return self._pages
 
+    def _build_pages(self):
+        self.refresh()
+        all_pages = [(source, page) for source in self._sources for page in source.wiki.pages]
+        if self.jobs > 1:
+            self._extract_in_parallel([page for source, page in all_pages])
+        # Checking which pages are terms extracts every page's data, so only
+        # after that is there everything to save.
+        self._check_tags([page for source, page in all_pages if page.is_term])
+        for source in self._sources:
+            source.wiki.cache.save()
+            source.wiki.close()
+        self._all_pages = all_pages
+        self._index_pages()
+
+    def _index_pages(self):
+        """
+        Pick the pages that belong in the glossary out of all the pages in its
+        sources, sort them, and index them so lookups while rendering don't have
+        to scan them all.
+        """
+        predicates = {}
+        for source in self._sources:
+            if source.subset is not None:
+                predicates[source] = tagsel.compile_expr(source.subset)
+        pages = []
+        for source, page in self._all_pages:
+            if page.is_term:
+                matches = predicates.get(source)
+                if (matches is None) or matches(tagsel.tag_ids(page.tags)):
+                    pages.append(page)
+        pages.sort(key=lambda p: p.fragment)
+        self._by_fragment = {}
+        self._by_acronym = {}
+        for page in pages:
+            self._by_fragment.setdefault(page.fragment, page)
+            if page.acronym:
+                self._by_acronym.setdefault(page.acronym.lower(), page)
+        self._pages = pages
+
+    def update(self):
+        """
+        Bring the glossary up to date with the local clones of its sources, without
+        pulling. Only pages whose files changed are read again (all of a wiki's
+        pages if its HEAD moved, since their histories may have too). From then
+        on, rendering reuses the html of every entry the changes didn't affect.
+        Return how many pages were added, changed or removed.
+        """
+        if self._pages is None:
+            self.pages
+        with timing.stage('Glossary.update'):
+            if self._entries is None:
+                self._entries = {}
+                # The first update only learns where each wiki's HEAD is.
+                self._heads = dict((s.wiki.repo_name, tw.get_head(s.wiki.folder)) for s in self._sources)
+            old = dict(((source, page.path), page) for source, page in self._all_pages)
+            all_pages = []
+            stale = set()
+            changed = 0
+            for source in self._sources:
+                w = source.wiki
+                head = tw.get_head(w.folder)
+                moved = head != self._heads.get(w.repo_name)
+                if moved:
+                    w.forget_histories()
+                    self._heads[w.repo_name] = head
+                for path in w.page_paths():
+                    path = os.path.normpath(os.path.abspath(path))
+                    try:
+                        key = cache.file_key(path)
+                    except OSError:
+                        # Gone since the folder was listed; treat it as deleted.
+                        continue
+                    page = old.pop((source, path), None)
+                    if page is None or moved or page.file_key != key:
+                        if page is not None:
+                            stale.add(page.fragment)
+                        page = tw.Page(path, w)
+                        stale.add(page.fragment)
+                        changed += 1
+                    all_pages.append((source, page))
+            # Whatever is left was deleted.
+            for source, path in old:
+                stale.add(old[(source, path)].fragment)
+                changed += 1
+            if changed:
+                self._all_pages = all_pages
+                self._index_pages()
+                # Indexing extracted the changed pages' data; keep it for the next build.
+                for source in self._sources:
+                    source.wiki.cache.save()
+                # Entries show the hover text of the terms they link to, so they're
+                # affected by changes to those terms as well as to themselves.
+                current = set(self._pages)
+                for page in list(self._entries):
+                    if page not in current or stale.intersection(page.links):
+                        del self._entries[page]
+            return changed
+
+    def watch_files(self):
+        """
+        Get ready to follow edits to the sources' files with update(), and do the
+        first update. Call this before the glossary is built.
+        """
+        # update() spots changed pages by comparing their files' fingerprints,
+        # which pages that came from a manifest don't have.
+        for source in self._sources:
+            source.wiki.use_manifest = False
+        self.update()
+
+    def _check_tags(self, pages):
+        """
+        Warn about tags that look like misspellings: tags in a subset that no page
+        carries, and tags on just one term page when a more common tag is a typo away.
+        """
+        # Tags are compared the way tag expressions match them.
+        counts = {}
+        for page in pages:
+            for t in page.tags:
+                t = normalize(t)
+                counts[t] = counts.get(t, 0) + 1
+        tree = None
+        for source in self._sources:
+            if source.subset is not None:
+                for t in tagsel.expr_tags(source.subset):
+                    if t not in counts:
+                        tree = tree or BKTree(counts)
+                        suggestions = [x for d, x in tree.find(t)]
+                        sys.stderr.write('No page in the glossary is tagged %s.%s\n' % (
+                            t, (' Did you mean %s?' % ' or '.join(suggestions)) if suggestions else ''))
+        # Only tags used more than once are worth suggesting in place of a one-off.
+        common_tags = None
+        for page in pages:
+            for t in page.tags:
+                t = normalize(t)
+                if counts[t] == 1:
+                    if common_tags is None:
+                        common_tags = BKTree(x for x in counts if counts[x] > 1)
+                    suggestions = [x for d, x in common_tags.find(t)]
+                    if suggestions:
+                        _warn_once(page.wiki, '%s is the only page tagged %s. Did you mean %s?\n' % (
+                            page.path, t, ' or '.join(suggestions)))
+
+    def _extract_in_parallel(self, pages):
+        """
+        Parse every page that isn't already cached, spread across a pool of processes.
+        """
+        todo = [page for page in pages if not page.load_cached_data()]
+        if len(todo) > 1:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=self.jobs) as pool:
+                chunksize = max(1, len(todo) // (self.jobs * 4))
+                # Pages from git are read here, since the workers have no wiki.
+                texts = [page.read() if page.blob else None for page in todo]
+                results = pool.map(tw.extract_page_data, [page.path for page in todo], texts, chunksize=chunksize)
+                for page, data in zip(todo, results):
+                    page.data = data
+
     @property
     def primary_source(self):
         return self._sources[0] if self._sources else None
 
     def find_page(self, fragment):
-        for page in self.pages:
-            if page.fragment == fragment:
-                return page
-
-    def fix_hyperlinks(self):
-        for page in self.pages:
-            for link in markdown.walk_hyperlinks(page.ast):
-                if WIKI_PAGE_LINK_PAT.match(link.dest):
-                    target_page = self.find_page(link.dest)
-                    link.dest = '#' + link.dest
-                    if target_page:
-                        link.title = target_page.hovertext
-                    else:
-                        sys.stderr.write('Broken hyperlink to %s in %s.\n' % (link.dest, page.path))
-                        sys.stderr.flush()
+        if self.pages:
+            return self._by_fragment.get(fragment)
+
+    def find_acronym(self, acronym):
+        if self.pages:
+            return self._by_acronym.get(acronym.lower())
+
+    def fix_hyperlinks(self, page):
+        """
+        Return the html for a page's definition, with each link to another term
+        in the glossary carrying that term's hover text.
+        """
+        with timing.stage('Glossary.fix_hyperlinks'):
+            titles = {}
+            for fragment in page.links:
+                target_page = self.find_page(fragment)
+                if target_page:
+                    titles[fragment] = target_page.hovertext
                 else:
-                    m = SHORT_EXTERNAL_GLOSSARY_LINK_PAT.match(link.dest)
-                    if m:
-                        link.dest = 'https://trustoverip.github.io/' + m.group(2) + '/glossary.html#' + m.group(1)
+                    sys.stderr.write('Broken hyperlink to #%s in %s.\n' % (fragment, page.path))
+                    sys.stderr.flush()
+            return markdown.join_definition(page.definition, titles)
 
     def render(self):
-        self.fix_hyperlinks()
-
-        # Write the pieces of the output to 3 separate buffers so we can build
-        # the nav stuff as we process the pages, but order the nav before the
-        # main glossary.
-        doc = io.StringIO()
-        nav = io.StringIO()
-        inner = io.StringIO()
+        out = io.StringIO()
+        self.render_to(out)
+        return out.getvalue()
+
+    @property
+    def use_svgs(self):
         # In the long run, I'd like to write a feature entirely in javascript,
         # where, after the page loads, js automatically adds SVGs with the
         # features that support hovering over a term to get a clickable icon
@@ -116,71 +349,160 @@ class Glossary:
         # line keeps things clean by checking to see whether the frame of the
         # glossary has the right supporting infrastructure. if yes, then the
         # glossary rendering code inserts the SVGs.
-        use_svgs = (not self.is_standalone_doc) and self.frame and (
+        return (not self.is_standalone_doc) and self.frame and (
                 '<svg' in self.frame and '_slf' in self.frame and '_xl' in self.frame
                 and 'copyUrl' in self.frame and 'goto' in self.frame
         )
 
+    def render_to(self, out, pages=None):
+        """
+        Write the glossary to a stream, one page at a time, so output starts
+        flowing right away and the whole document never has to be held in memory.
+        If pages is given, only those pages (in glossary order) are included.
+        """
+        use_svgs = self.use_svgs
+        # Build the page list first, so its cost isn't counted as rendering.
+        if pages is None:
+            pages = self.pages
+        with timing.stage('Glossary.render'):
+            self._render_to(out, use_svgs, pages)
+
+    def _render_to(self, out, use_svgs, pages):
         if self.is_standalone_doc:
-            doc.write("<html>\n<head>\n")
-            doc.write("  <title>%s</title>\n" % self.title)
+            out.write("<html>\n<head>\n")
+            out.write("  <title>%s</title>\n" % self.title)
             if self.css:
-                doc.write('  <link rel="stylesheet" href="%s">\n' % self.css)
+                out.write('  <link rel="stylesheet" href="%s">\n' % self.css)
             else:
-                doc.write(DEFAULT_CSS)
-            doc.write("</head>\n<body>\n<header>%s</header>\n" % self.title)
+                out.write(DEFAULT_CSS)
+            out.write("</head>\n<body>\n<header>%s</header>\n" % self.title)
+            self._render_nav(out, pages)
+            out.write("<main>\n")
+            self._render_main(out, use_svgs, pages)
+            out.write("</main>\n</body>\n</html>\n")
+        elif self.frame:
+            # The frame alternates between literal text and %nav/%main placeholders.
+            for i, piece in enumerate(FRAME_PLACEHOLDER_PAT.split(self.frame)):
+                if i % 2 == 0:
+                    out.write(piece)
+                elif piece == '%nav':
+                    self._render_nav(out, pages)
+                else:
+                    self._render_main(out, use_svgs, pages)
+        else:
+            self._render_main(out, use_svgs, pages)
 
-        toc = []
-        current_char = None
-        inner.write('<dl id="glossary_content">')
-        for page in self.pages:
-            try:
-                # First term that starts with this letter?
-                char = page.fragment[0].upper()
-                if char != current_char:
-                    current_char = char
-                    toc.append(char)
-                    inner.write('\n<dt id="%s" class="letter">%s</td>' % (char, char))
-                inner.write('\n<dt id="%s">' % page.fragment)
-                if use_svgs:
-                    inner.write('<svg class="_slf" onclick="copyUrl(\'#%s\')"><use href="#_slf"/></svg>' % page.fragment)
-                inner.write('%s ' % (page.term_minus_acronym))
-                if use_svgs:
-                    inner.write('<svg class="_xl" onclick="goto(\'%s/%s\')"><use href="#_xl"/></svg>' % (
-                                page.wiki.code_repo_url[:-4] + '/wiki/', page.fragment))
-                for t in page.tags:
-                    inner.write('<span class="tag">%s</span>' % t)
-                inner.write('</dt>\n')
-                this_def = page.get_section_by_fragment('definition')
-                if not this_def:
-                    this_def = page.get_section_by_fragment('see')
-                if this_def:
-                    inner.write("<dd>%s" % markdown.render_html(this_def.content))
-                    if page.history and self.write_meta:
-                        cdate = datetime.date.fromtimestamp(page.creation_date).strftime("%Y-%m-%d")
-                        inner.write('<p class="meta">version %d, commit %s, created %s, ' % (
-                            page.version, page.hash, cdate))
-                        if page.version > 1:
-                            inner.write('last modified %s, ' %
-                                        datetime.date.fromtimestamp(page.lastmod_date).strftime("%Y-%m-%d"))
-                        inner.write('contributors %s</p>\n' % ' - '.join(page.contributors))
-                    inner.write("</dd>\n")
-            except:
-                sys.stderr.write('Problem with %s.' % page.path)
-                raise
-        inner.write("</dl>\n")
-
-        nav.write('<nav>[ ')
+    def _render_nav(self, out, pages):
+        # Pages are sorted, so we know which letters have terms before rendering any.
+        toc = set(page.fragment[0].upper() for page in pages)
+        out.write('<nav>[ ')
         for char in 'ABCDEFGHIJKLMNOPQRSTUVWXYZ':
             if char in toc:
-                nav.write('<a href="#%s">%s</a> ' % (char, char))
+                out.write('<a href="#%s">%s</a> ' % (char, char))
             else:
-                nav.write('%s ' % char)
-        nav.write(']</nav>\n')
+                out.write('%s ' % char)
+        out.write(']</nav>\n')
 
-        if self.is_standalone_doc:
-            return doc.getvalue() + nav.getvalue() + "<main>\n" + inner.getvalue() + "</main>\n</body>\n</html>\n"
-        elif self.frame:
-            return self.frame.replace('%nav', nav.getvalue()).replace('%main', inner.getvalue())
+    def _render_main(self, out, use_svgs, pages):
+        current_char = None
+        out.write('<dl id="glossary_content">')
+        for page in pages:
+            # First term that starts with this letter?
+            char = page.fragment[0].upper()
+            if char != current_char:
+                current_char = char
+                out.write('\n<dt id="%s" class="letter">%s</td>' % (char, char))
+            if self._entries is None:
+                self._render_entry(out, page, use_svgs)
+            else:
+                out.write(self._entry_html(page, use_svgs))
+        out.write("</dl>\n")
+
+    def entry_html(self, page):
+        """
+        Return the html of a single page's entry in the glossary (its <dt> and <dd>).
+        """
+        return self._entry_html(page, self.use_svgs)
+
+    def _entry_html(self, page, use_svgs):
+        entry = self._entries.get(page) if self._entries is not None else None
+        if entry is None:
+            buf = io.StringIO()
+            self._render_entry(buf, page, use_svgs)
+            entry = buf.getvalue()
+            if self._entries is not None:
+                self._entries[page] = entry
+        return entry
+
+    def _render_entry(self, out, page, use_svgs):
+        try:
+            out.write('\n<dt id="%s">' % page.fragment)
+            if use_svgs:
+                out.write('<svg class="_slf" onclick="copyUrl(\'#%s\')"><use href="#_slf"/></svg>' % page.fragment)
+            out.write('%s ' % (page.term_minus_acronym))
+            if use_svgs:
+                out.write('<svg class="_xl" onclick="goto(\'%s/%s\')"><use href="#_xl"/></svg>' % (
+                          page.wiki.code_repo_url[:-4] + '/wiki/', page.fragment))
+            for t in page.tags:
+                out.write('<span class="tag">%s</span>' % t)
+            out.write('</dt>\n')
+            out.write("<dd>%s" % self.fix_hyperlinks(page))
+            if page.history and self.write_meta:
+                cdate = datetime.date.fromtimestamp(page.creation_date).strftime("%Y-%m-%d")
+                out.write('<p class="meta">version %d, commit %s, created %s, ' % (
+                    page.version, page.hash, cdate))
+                if page.version > 1:
+                    out.write('last modified %s, ' %
+                              datetime.date.fromtimestamp(page.lastmod_date).strftime("%Y-%m-%d"))
+                out.write('contributors %s</p>\n' % ' - '.join(page.contributors))
+            out.write("</dd>\n")
+        except:
+            sys.stderr.write('Problem with %s.' % page.path)
+            raise
+
+
+def diff_terms(old_pages, new_pages):
+    """
+    Compare two versions of a glossary's pages, matching terms by fragment.
+    Return the fragments of the terms that were added, removed, and changed.
+    """
+    old = dict((page.fragment, page) for page in old_pages)
+    new = dict((page.fragment, page) for page in new_pages)
+    added = [f for f in new if f not in old]
+    removed = [f for f in old if f not in new]
+    changed = [f for f in new if f in old and new[f].data != old[f].data]
+    return added, removed, changed
+
+
+def build_timeline(cfg, pattern=None, jobs=1, offline=False):
+    """
+    Build the glossary that cfg describes as it stood at each tag (optionally,
+    each tag matching a glob pattern) of its primary source, oldest first. Its
+    other sources are read as configured. Yield (tag, Glossary) pairs.
+
+    Every revision reads pages through the same blob cache, so a version of a
+    page is only parsed once, however many revisions it appears in.
+    """
+    sources = cfg.get('sources')
+    primary = tw.TermsWiki(sources[0].get('wiki'))
+    primary.configure(dict(cfg.get('git') or {}, **sources[0].get('git', {})))
+    if primary.is_cloned:
+        # A refresh can skip fetching when the branch hasn't moved, but tags can
+        # still have been pushed.
+        tw.fetch_refs(primary.folder)
+    else:
+        primary.refresh()
+    wikis = {}
+    blobs = None
+    for tag in tw.list_tags(primary.folder, pattern):
+        g = Glossary(dict(cfg, sources=[dict(sources[0], at=tag)] + sources[1:]), jobs, offline, wikis)
+        w = g.primary_source.wiki
+        if blobs is None:
+            blobs = w.cache
         else:
-            return inner.getvalue()
+            w.cache = blobs
+        yield tag, g
+        # Wikis that aren't pinned to a tag are the same for every revision,
+        # so keep them; the rest are done with.
+        for key in [key for key, wiki in wikis.items() if wiki.rev]:
+            del wikis[key]
@@ -0,0 +1,84 @@
+"""
+On-disk cache of things downloaded over http (such as a glossary's frame), so
+they're only downloaded again when they've changed.
+
+Each url is cached in its own json file, along with the ETag and Last-Modified
+headers it came with. Refetching sends those back in a conditional request, so
+an unchanged resource costs a "304 Not Modified" instead of the whole body. A
+copy that is younger than max_age isn't checked at all, and in offline mode the
+network is never touched.
+"""
+import hashlib
+import json
+import os
+import sys
+import time
+
+from . import cache
+
+# Seconds to wait for a server to connect or send data before giving up.
+DEFAULT_TIMEOUT = 30
+
+
+def cache_path(url):
+    return os.path.join(cache.CACHE_PATH, 'http', hashlib.sha256(url.encode('utf-8')).hexdigest() + '.json')
+
+
+def _load(url):
+    try:
+        with open(cache_path(url), 'rt') as f:
+            entry = json.load(f)
+        if entry.get('url') == url:
+            return entry
+    except (OSError, ValueError):
+        pass
+
+
+def _save(entry):
+    path = cache_path(entry['url'])
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + '.tmp'
+    with open(tmp, 'wt') as f:
+        json.dump(entry, f)
+    os.replace(tmp, path)
+
+
+def fetch(url, max_age=0, offline=False, timeout=DEFAULT_TIMEOUT):
+    """
+    Return the text at url, from the cache if possible. A cached copy fetched or
+    revalidated less than max_age seconds ago is used without asking the server.
+    If offline, any cached copy is used, however old. If the server can't be
+    reached, a cached copy is used with a warning rather than failing the run.
+    """
+    entry = _load(url)
+    if entry and (offline or time.time() - entry['fetched'] < max_age):
+        return entry['text']
+    if offline:
+        raise Exception("Can't fetch %s while offline; it has never been downloaded." % url)
+    headers = {}
+    if entry:
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+    import requests
+    try:
+        r = requests.get(url, headers=headers, timeout=timeout)
+        if r.status_code != 304:
+            r.raise_for_status()
+    except requests.RequestException as e:
+        if not entry:
+            raise
+        sys.stderr.write("Couldn't refresh %s (%s); using the copy cached %s.\n" % (
+            url, e, time.strftime('%Y-%m-%d %H:%M', time.localtime(entry['fetched']))))
+        return entry['text']
+    if r.status_code != 304 or not entry:
+        entry = {
+            'url': url,
+            'etag': r.headers.get('ETag'),
+            'last_modified': r.headers.get('Last-Modified'),
+            'text': r.text,
+        }
+    entry['fetched'] = time.time()
+    _save(entry)
+    return entry['text']
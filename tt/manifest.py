@@ -0,0 +1,47 @@
+"""
+Manifests of the term pages in each cloned wiki, written by "tt index". A manifest
+holds everything a glossary needs from each term page, history included, as of
+one commit. As long as the wiki's HEAD hasn't moved since, a glossary can be
+assembled from the manifest without reading, parsing or running git on any page,
+except those that have been edited in the local clone.
+"""
+import json
+import os
+
+from . import cache
+
+# Bump this whenever the shape of a manifest changes.
+MANIFEST_VERSION = 3
+
+
+class Manifest:
+    """
+    The manifest of one wiki, stored in a single json file. Each entry is a
+    list of fields, as produced by tw.Page.to_manifest().
+    """
+    def __init__(self, name):
+        self.path = os.path.join(cache.CACHE_PATH, 'manifests', name + '.json')
+
+    def load(self, head):
+        """
+        Return the entries in the manifest and the paths of the files it leaves
+        out because they were edited when it was written, or None if there is no
+        manifest or it was written at some commit other than head.
+        """
+        if head is None:
+            return None
+        try:
+            with open(self.path, 'rt') as f:
+                saved = json.load(f)
+            if saved.get('version') == MANIFEST_VERSION and saved.get('head') == head:
+                return saved['pages'], saved['unlisted']
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def save(self, head, entries, unlisted=()):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = self.path + '.tmp'
+        with open(tmp, 'wt') as f:
+            json.dump({'version': MANIFEST_VERSION, 'head': head, 'pages': entries, 'unlisted': list(unlisted)},
+                      f, separators=(',', ':'))
+        os.replace(tmp, self.path)
@@ -1,46 +1,133 @@
-import marko
+"""
+Parse, split and render markdown. marko, which does the real work, isn't imported
+until it's first needed (see markoext), since commands that only read cached page
+data never need it.
+"""
+import html
 import re
+import threading
+
+# Stands for a link that split_definition() took out of rendered html. Parsing
+# replaces U+0000 (as CommonMark requires), so it can't come from page text.
+LINK_MARK = '\x00'
+
+# Parsing and rendering happen several times per page, so rather than building
+# a new marko parser or renderer every time, each thread keeps one of each.
+# (They hold state while they work, so threads can't share them.)
+_local = threading.local()
+
+
+def _parser():
+    try:
+        return _local.parser
+    except AttributeError:
+        import marko
+        from .markoext import MarkdownRenderer
+        _local.parser = marko.Markdown(renderer=MarkdownRenderer)
+        return _local.parser
+
+
+def _renderer(which):
+    r = getattr(_local, which, None)
+    if r is None:
+        if which == 'html':
+            import marko
+            r = marko.HTMLRenderer()
+        elif which == 'definition':
+            from .markoext import DefinitionRenderer
+            r = DefinitionRenderer()
+        else:
+            from .markoext import MarkdownRenderer
+            r = MarkdownRenderer()
+        setattr(_local, which, r)
+    # A renderer remembers the first node it rendered; forget the last one's.
+    r.root_node = None
+    return r
 
 
 def parse(markdown_text):
     """
     Turn markdown text into an abstract syntax tree (AST).
     """
-    md = marko.Markdown(renderer=MarkdownRenderer)
-    return md.parse(markdown_text)
+    return _parser().parse(markdown_text.replace('\x00', '\ufffd'))
 
 
 def render(ast):
     """
     Turn an abstract syntax tree (AST) into markdown text.
     """
-    r = MarkdownRenderer()
-    return r.render(ast)
+    return _renderer('markdown').render(ast)
 
 
 def render_html(ast):
     """
     Turn an abstract syntax tree (AST) into html.
     """
-    r = marko.HTMLRenderer()
-    return r.render(ast)
+    return _renderer('html').render(ast)
+
+
+def split_definition(ast, fragments):
+    """
+    Render an AST as html, but keep each link to one of the pages named in
+    fragments apart, as [fragment, title, body html], so its title can be set
+    once it's known which glossary the page is in. Return a list of html strings
+    and such links; join_definition() puts them back together.
+    """
+    r = _renderer('definition')
+    r.fragments = fragments
+    r.links = []
+    pieces = r.render(ast).split(LINK_MARK)
+    parts = [pieces[0]]
+    for link, piece in zip(r.links, pieces[1:]):
+        parts += [link, piece]
+    return [part for part in parts if part]
+
+
+def join_definition(parts, titles):
+    """
+    Turn what split_definition() returned into html. A link whose fragment is in
+    titles gets that title instead of its own.
+    """
+    html = []
+    for part in parts:
+        if isinstance(part, str):
+            html.append(part)
+        else:
+            fragment, title, body = part
+            title = titles.get(fragment, title)
+            html.append('<a href="#%s"%s>%s</a>' % (
+                fragment, ' title="%s"' % escape_html(title) if title else '', body))
+    return ''.join(html)
+
+
+def escape_html(text):
+    """
+    Escape text for use in html, the same way rendered html is escaped. (This is
+    marko.HTMLRenderer.escape_html, copied so glossaries built from cached page
+    data don't need marko at all.)
+    """
+    return html.escape(html.unescape(text)).replace("&#x27;", "'")
 
 
 def walk_hyperlinks(ast):
-    if type(ast) is marko.inline.Link:
+    import marko.inline
+    return _walk(ast, marko.inline.Link)
+
+
+def _walk(ast, node_type):
+    if type(ast) is node_type:
         yield ast
     elif hasattr(ast, 'children') and ast.children and type(ast.children) is not str:
         for child in ast.children:
-            for link in walk_hyperlinks(child):
-                yield link
+            for node in _walk(child, node_type):
+                yield node
 
 
 _TAG_PAT = re.compile('<[^>]+>')
 
 
 def make_hovertext(ast):
-    r = marko.HTMLRenderer()
-    txt = _TAG_PAT.sub('', r.render(ast))
+    txt = _TAG_PAT.sub('', render_html(ast))
     i = txt.find('\n')
     if i > -1:
         txt = txt[:i].rstrip()
@@ -50,7 +137,22 @@ def make_hovertext(ast):
     return txt
 
 
+class Sections(list):
+    """
+    The sections of a page, in order, plus a dict that maps the fragment of
+    each section's heading to the first section with that fragment.
+    """
+    def __init__(self, sections):
+        list.__init__(self, sections)
+        self.by_fragment = {}
+        for section in sections:
+            if section.heading:
+                self.by_fragment.setdefault(section.fragment, section)
+
+
 def split(ast):
+    import marko.block
+    from .markoext import Section
     sections = []
     section_children = []
     first_header_level = None
@@ -75,7 +177,7 @@ def split(ast):
             section_children.append(child)
     if section_children:
         sections.append(Section(section_children))
-    return sections
+    return Sections(sections)
 
 
 NON_ALPHANUMS_PAT = re.compile('[^a-z0-9]+', re.I)
@@ -85,181 +187,25 @@ def title_to_fragment(title):
     return NON_ALPHANUMS_PAT.sub(' ', title.lower()).strip().replace(' ', '-')
 
 
-class MarkdownRenderer(marko.renderer.Renderer):
-    """
-    Starting from a parsed markdown AST, render back to markdown all over again.
-    This is used when we want to update markdown files; the updates go in the
-    AST and then we generate new markdown for it. The round trip is slightly
-    lossy, because stylistic choices in markdown (e.g., using * versus - for
-    list items, or *...* versus _..._ for bold, are not retained.
-
-    Example::
-        with open('sample.md', 'rt') as f:
-            md = f.read()
-
-        markdown = marko.Markdown(renderer=MarkdownRenderer)
-        ast = markdown.parse(md)
-        print(markdown.render(ast))
-    """
-
-    def render_paragraph(self, element):
-        children = self.render_children(element)
-        if element._tight:
-            return children
-        else:
-            return f"{children}\n"
-
-    def render_list(self, element):
-        if element.ordered:
-            self.list_item_token = '1. '
-        else:
-            self.list_item_token = '* '
-        return "{children}\n".format(
-            children=self.render_children(element)
-        )
-
-    def render_list_item(self, element):
-        return "{}{}\n".format(self.list_item_token, self.render_children(element))
-
-    def render_quote(self, element):
-        return "> {}".format(self.render_children(element))
-
-    def render_fenced_code(self, element):
-        lang = (
-            element.lang
-            if element.lang
-            else ""
-        )
-        return "```{}\n{}```\n".format(
-            lang, element.children[0].children
-        )
-
-    def render_code_block(self, element):
-        return self.render_fenced_code(element)
-
-    def render_html_block(self, element):
-        return element.children
-
-    def render_thematic_break(self, element):
-        return "<hr />\n"
-
-    def render_heading(self, element):
-        return '#' * element.level + " {children}\n".format(
-            children=self.render_children(element)
-        )
-
-    def render_setext_heading(self, element):
-        return self.render_heading(element)
-
-    def render_blank_line(self, element):
-        return "\n"
-
-    def render_link_ref_def(self, element):
-        return ""
-
-    def render_emphasis(self, element):
-        return "*{}*".format(self.render_children(element))
-
-    def render_strong_emphasis(self, element):
-        return "**{}**".format(self.render_children(element))
-
-    def render_inline_html(self, element):
-        return self.render_html_block(element)
-
-    def render_plain_text(self, element):
-        if isinstance(element.children, str):
-            return element.children
-        return self.render_children(element)
-
-    def render_link(self, element):
-        return '[{}]({})'.format(self.render_children(element), element.dest)
-
-    def render_auto_link(self, element):
-        return self.render_link(element)
-
-    def render_image(self, element):
-        template = '![{}]({})'
-        render_func = self.render
-        self.render = self.render_plain_text
-        body = self.render_children(element)
-        self.render = render_func
-        return template.format(body, element.dest)
-
-    def render_literal(self, element):
-        return self.render_raw_text(element)
-
-    def render_raw_text(self, element):
-        return element.children
-
-    def render_line_break(self, element):
-        if element.soft:
-            return "\n"
-        return "<br />\n"
-
-    def render_code_span(self, element):
-        return "`{}`".format(element.children)
-
-
-class Section(marko.block.BlockElement):
-
-    @classmethod
-    def match(cls, source):
-        pass
-
-    def __init__(self, children):
-        self.link_ref_defs = {}
-        self.children = children
-        self._title = None
-        self._text = None
-        self._content = None
-
-    @property
-    def heading(self):
-        for child in self.children:
-            if type(child) is marko.block.Heading:
-                return child
-
-    @property
-    def title(self):
-        if self._title is None:
-            md = MarkdownRenderer()
-            self._title = md.render_children(self.heading)
-        return self._title
-
-    @property
-    def content(self):
-        if self._content is None:
-            for i in range(len(self.children)):
-                child = self.children[i]
-                if type(child) is marko.block.Heading:
-                    self._content = Section(self.children[i + 1:])
-        return self._content
-
-    @property
-    def text(self):
-        if self._text is None:
-            md = MarkdownRenderer()
-            self._text = md.render_children(self.content)
-        return self._text
-
-    @property
-    def fragment(self):
-        return title_to_fragment(self.title)
-
-    @property
-    def text(self):
-        return render(self.content)
-
-    def __str__(self):
-        return '# %s\n%s' % (self.title, self.text)
-
+def __getattr__(name):
+    # Keep markdown.marko, markdown.MarkdownRenderer and markdown.Section working
+    # without importing marko up front.
+    if name == 'marko':
+        import marko
+        return marko
+    if name in ('MarkdownRenderer', 'Section'):
+        from . import markoext
+        return getattr(markoext, name)
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
 
 
 if __name__ == '__main__':
     import os
+    import marko
+    from .markoext import MarkdownRenderer
     with open(os.path.join(os.path.dirname(__file__), 'tests/sample-page.md'), 'rt') as f:
         text = f.read()
 
     markdown = marko.Markdown(renderer=MarkdownRenderer)
     ast = markdown.parse(text)
-    print(markdown.render(ast))
\ No newline at end of file
+    print(markdown.render(ast))
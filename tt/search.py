@@ -0,0 +1,158 @@
+"""
+A full-text index of the term pages in all cloned wikis, kept in an SQLite
+database and searched with FTS5.
+
+Each term page is one row, with its term, its definition and the text of its
+other sections in separate columns, so matches in a term can count for more
+than matches in a definition, and those for more than matches elsewhere. The
+index remembers which commit of each wiki it has seen, and brings itself up to
+date by asking git which pages changed since then.
+"""
+import os
+import sqlite3
+
+from . import cache
+from . import git
+from . import tagsel
+from . import tw
+from .tag import normalize
+
+# Bump this whenever the schema changes; older databases are rebuilt.
+SCHEMA_VERSION = 1
+# How much a match in each column (term, definition, other sections) counts.
+WEIGHTS = (10.0, 4.0, 1.0)
+
+
+def index_path():
+    return os.path.join(cache.CACHE_PATH, 'search.db')
+
+
+class Hit:
+    def __init__(self, wiki, fragment, term, tags, snippet):
+        self.wiki = wiki
+        self.fragment = fragment
+        self.term = term
+        self.tags = tags
+        self.snippet = snippet
+
+
+def _fts_phrases(query):
+    """
+    Turn free text into an FTS5 query that matches every word, ignoring any
+    punctuation FTS5 would otherwise treat as syntax.
+    """
+    return ' '.join('"%s"' % word.replace('"', '""') for word in query.split())
+
+
+class SearchIndex:
+    def __init__(self, path=None):
+        path = path or index_path()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.db = sqlite3.connect(path)
+        if self.db.execute('PRAGMA user_version').fetchone()[0] != SCHEMA_VERSION:
+            self._create()
+
+    def _create(self):
+        with self.db:
+            self.db.executescript('''
+                DROP TABLE IF EXISTS wikis;
+                DROP TABLE IF EXISTS pages;
+                DROP TABLE IF EXISTS text;
+                CREATE TABLE wikis (name TEXT PRIMARY KEY, head TEXT);
+                CREATE TABLE pages (id INTEGER PRIMARY KEY, wiki TEXT, rel_path TEXT,
+                                    fragment TEXT, term TEXT, tags TEXT, UNIQUE (wiki, rel_path));
+                CREATE VIRTUAL TABLE text USING fts5(term, definition, other, tokenize='porter unicode61');
+                PRAGMA user_version = %d;
+            ''' % SCHEMA_VERSION)
+
+    def close(self):
+        self.db.close()
+
+    def _add(self, wiki, page):
+        if not page.is_term:
+            return
+        sections = dict(page.data['sections'])
+        definition = sections.pop('definition', '') or sections.pop('see', '')
+        tags = ' '.join(sorted(set(normalize(t) for t in page.tags)))
+        cursor = self.db.execute('INSERT INTO pages (wiki, rel_path, fragment, term, tags) VALUES (?, ?, ?, ?, ?)',
+                                 (wiki.repo_name, wiki.rel_path(page.path), page.fragment, page.term, tags))
+        self.db.execute('INSERT INTO text (rowid, term, definition, other) VALUES (?, ?, ?, ?)',
+                        (cursor.lastrowid, page.term, definition, '\n'.join(sections.values())))
+
+    def _remove(self, wiki_name, rel_path=None):
+        """
+        Forget one page of a wiki, or all of them if rel_path is None.
+        """
+        if rel_path is None:
+            ids = self.db.execute('SELECT id FROM pages WHERE wiki = ?', (wiki_name,)).fetchall()
+        else:
+            ids = self.db.execute('SELECT id FROM pages WHERE wiki = ? AND rel_path = ?',
+                                  (wiki_name, rel_path)).fetchall()
+        self.db.executemany('DELETE FROM text WHERE rowid = ?', ids)
+        self.db.executemany('DELETE FROM pages WHERE id = ?', ids)
+
+    def update(self, wikis):
+        """
+        Bring the index up to date with the local clones of wikis. A wiki whose
+        HEAD has moved since it was indexed only has the pages that git says
+        changed re-read; wikis that aren't listed are dropped. Return how many
+        wikis changed.
+        """
+        changed = 0
+        heads = dict(self.db.execute('SELECT name, head FROM wikis'))
+        with self.db:
+            for w in wikis:
+                head = git.get_head(w.folder)
+                old = heads.pop(w.repo_name, None)
+                if head == old:
+                    continue
+                changed += 1
+                if old and git.resolve(w.folder, old):
+                    for status, rel_path in git.get_changes(w.folder, old, head):
+                        if rel_path.endswith('.md'):
+                            self._remove(w.repo_name, rel_path)
+                            if status != 'D':
+                                self._add(w, tw.Page(os.path.join(w.folder, rel_path), w))
+                    w.cache.save()
+                else:
+                    # Never indexed, or the history it was indexed at is gone.
+                    self._remove(w.repo_name)
+                    for page in w.walk():
+                        self._add(w, page)
+                self.db.execute('INSERT OR REPLACE INTO wikis (name, head) VALUES (?, ?)', (w.repo_name, head))
+            for name in heads:
+                self._remove(name)
+                self.db.execute('DELETE FROM wikis WHERE name = ?', (name,))
+                changed += 1
+        return changed
+
+    def search(self, query, subset=None, limit=20):
+        """
+        Return Hits for the term pages that best match query, best first. Query
+        can use FTS5 syntax; if it isn't valid FTS5, its words are matched as
+        plain text. If subset is a parsed tagsel expression, only pages whose
+        tags match it are returned.
+        """
+        matches = tagsel.compile_expr(subset) if subset is not None else None
+        # The term is shown anyway, so the snippet comes from the definition, or
+        # from the other sections if that's where the match is.
+        sql = ('SELECT pages.wiki, pages.fragment, pages.term, pages.tags, '
+               "snippet(text, 1, '\x02', '\x03', '...', 12), snippet(text, 2, '\x02', '\x03', '...', 12) "
+               'FROM text JOIN pages ON pages.id = text.rowid '
+               'WHERE text MATCH ? ORDER BY bm25(text, %s, %s, %s)' % WEIGHTS)
+        try:
+            rows = self.db.execute(sql, (query,))
+        except sqlite3.OperationalError:
+            rows = self.db.execute(sql, (_fts_phrases(query),))
+        hits = []
+        for wiki, fragment, term, tags, definition, other in rows:
+            tags = tags.split()
+            if matches is None or matches(tagsel.tag_ids(tags)):
+                # The markers can't occur in the text, unlike brackets, which
+                # markdown links are full of.
+                snippet = other if ('\x02' in other and '\x02' not in definition) else definition
+                snippet = snippet.replace('\x02', '[').replace('\x03', ']')
+                hits.append(Hit(wiki, fragment, term, tags, ' '.join(snippet.split())))
+                if len(hits) == limit:
+                    break
+        return hits
@@ -0,0 +1,118 @@
+"""
+A long-lived local http server for a glossary. The glossary is parsed once and
+kept in memory, along with the html of each entry; when a request comes in,
+only pages whose files changed since the last request are read again.
+
+    /                       the whole glossary
+    /?tags=expr             just the terms whose tags match a tag expression
+    /term/fragment          one entry (its <dt> and <dd>), found by fragment or acronym
+    /term/fragment.json     one term, as json
+    /terms.json[?tags=expr] every term (or those whose tags match), as json
+"""
+import http.server
+import io
+import json
+import threading
+import time
+import urllib.parse
+
+from . import tagsel
+
+DEFAULT_PORT = 8000
+# Don't look for changed pages more often than this, in seconds.
+CHECK_INTERVAL = 0.5
+
+
+def term_json(g, page):
+    """
+    Return what a client might want to know about a term, as a json-friendly dict.
+    """
+    w = page.wiki
+    return {
+        'fragment': page.fragment,
+        'term': page.term,
+        'acronym': page.acronym,
+        'tags': list(page.tags),
+        'hovertext': page.hovertext,
+        'definition_html': g.fix_hyperlinks(page),
+        'wiki': w.repo_name if w else None,
+        'version': page.version,
+        'lastmod_date': page.lastmod_date,
+    }
+
+
+class GlossaryServer(http.server.ThreadingHTTPServer):
+    def __init__(self, glossary, address=('127.0.0.1', DEFAULT_PORT)):
+        # Build the glossary before listening, and have it start keeping each
+        # entry's html.
+        glossary.update()
+        http.server.ThreadingHTTPServer.__init__(self, address, GlossaryRequestHandler)
+        self.glossary = glossary
+        # Requests are handled in threads, but the glossary is only used by one
+        # at a time.
+        self.lock = threading.Lock()
+        self._checked = time.monotonic()
+        self._html = None
+
+    def check(self):
+        """
+        Re-read any pages whose files have changed. Call with the lock held.
+        """
+        now = time.monotonic()
+        if now - self._checked >= CHECK_INTERVAL:
+            self._checked = now
+            if self.glossary.update():
+                self._html = None
+
+    def render(self, pages=None):
+        if pages is None and self._html is not None:
+            return self._html
+        out = io.StringIO()
+        self.glossary.render_to(out, pages)
+        if pages is None:
+            self._html = out.getvalue()
+            return self._html
+        return out.getvalue()
+
+
+class GlossaryRequestHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        query = urllib.parse.parse_qs(url.query)
+        path = urllib.parse.unquote(url.path)
+        with self.server.lock:
+            self.server.check()
+            try:
+                status, content_type, body = self._route(path, query)
+            except tagsel.BadExpression as e:
+                status, content_type, body = 400, 'text/plain', str(e)
+        data = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type + '; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _route(self, path, query):
+        g = self.server.glossary
+        pages = None
+        if 'tags' in query:
+            matches = tagsel.compile_expr(tagsel.parse(query['tags'][0]))
+            pages = [page for page in g.pages if matches(tagsel.tag_ids(page.tags))]
+        if path == '/':
+            return 200, 'text/html', self.server.render(pages)
+        if path == '/terms.json':
+            if pages is None:
+                pages = g.pages
+            return 200, 'application/json', json.dumps([term_json(g, page) for page in pages])
+        if path.startswith('/term/'):
+            which = path[len('/term/'):]
+            as_json = which.endswith('.json')
+            if as_json:
+                which = which[:-len('.json')]
+            page = g.find_page(which) or g.find_acronym(which)
+            if page:
+                if as_json:
+                    return 200, 'application/json', json.dumps(term_json(g, page))
+                return 200, 'text/html', g.entry_html(page)
+        return 404, 'text/plain', 'Not found: %s' % path
@@ -11,37 +11,204 @@ def normalize(tag):
     return '#' + NON_ALPHANUMS_PAT.sub(' ', tag.lower()).strip().replace(' ', '-')
 
 
-def edit_distance(tag1, tag2):
-    tag1 = NON_ALPHANUMS_PAT.sub('', tag1.lower())
-    tag2 = NON_ALPHANUMS_PAT.sub('', tag2.lower())
-    return _damerau_levenshtein_distance(tag1, tag2)
+def edit_distance(tag1, tag2, max_distance=None):
+    return _damerau_levenshtein_distance(_distance_key(tag1), _distance_key(tag2), max_distance)
 
 
-def _damerau_levenshtein_distance(s1, s2):
+def _distance_key(tag):
+    return NON_ALPHANUMS_PAT.sub('', tag.lower())
+
+
+def suggestion_distance(tag):
+    """
+    How far a known tag can be from tag and still be worth suggesting. Short tags
+    get less leeway, or everything would look like a typo of everything else.
+    """
+    return 1 if len(_distance_key(tag)) <= 4 else 2
+
+
+class BKTree:
     """
-    Compute the Damerau-Levenshtein distance between two given
-    strings (s1 and s2). Code from https://www.guyrutenberg.com/2008/12/15/damerau-levenshtein-distance-in-python/
+    A Burkhard-Keller tree over a set of tags, for finding known tags that are
+    within a few edits of some other tag without computing the edit distance to
+    every known tag.
+
+    Each node's children are keyed by their distance from it; the triangle
+    inequality lets a search skip every child whose key is too far from the
+    query's distance to the node. edit_distance() doesn't quite obey that
+    inequality, so the tree is built with the unrestricted Damerau-Levenshtein
+    distance, which does and is never larger. Matches are then checked with
+    edit_distance(), so results are exactly what a brute force search would give.
     """
-    d = {}
-    lenstr1 = len(s1)
-    lenstr2 = len(s2)
-    for i in range(-1,lenstr1+1):
-        d[(i,-1)] = i+1
-    for j in range(-1,lenstr2+1):
-        d[(-1,j)] = j+1
+    def __init__(self, tags=()):
+        # Each node is [tag, distance key, {distance: child node}].
+        self.root = None
+        self.size = 0
+        for tag in tags:
+            self.add(tag)
+
+    def __len__(self):
+        return self.size
+
+    def add(self, tag):
+        key = _distance_key(tag)
+        if self.root is None:
+            self.root = [tag, key, {}]
+            self.size = 1
+            return
+        node = self.root
+        while True:
+            if node[0] == tag:
+                return
+            d = _unrestricted_damerau_levenshtein_distance(key, node[1])
+            child = node[2].get(d)
+            if child is None:
+                node[2][d] = [tag, key, {}]
+                self.size += 1
+                return
+            node = child
 
-    for i in range(lenstr1):
-        for j in range(lenstr2):
-            if s1[i] == s2[j]:
+    def find(self, tag, max_distance=None):
+        """
+        Return (distance, tag) pairs for each known tag within max_distance edits of
+        tag, closest first. By default, max_distance is suggestion_distance(tag).
+        """
+        if max_distance is None:
+            max_distance = suggestion_distance(tag)
+        key = _distance_key(tag)
+        found = []
+        todo = [self.root] if self.root else []
+        while todo:
+            node = todo.pop()
+            # Past this distance, neither the node nor any of its children can
+            # match, so there's no need to know exactly how far it is.
+            limit = max_distance + max(node[2]) if node[2] else max_distance
+            d = _unrestricted_damerau_levenshtein_distance(key, node[1], limit)
+            if d <= max_distance:
+                exact = _damerau_levenshtein_distance(key, node[1], max_distance)
+                if exact <= max_distance:
+                    found.append((exact, node[0]))
+            for child_d, child in node[2].items():
+                if d - max_distance <= child_d <= d + max_distance:
+                    todo.append(child)
+        found.sort()
+        return found
+
+
+def _damerau_levenshtein_distance(s1, s2, max_distance=None):
+    """
+    Compute the Damerau-Levenshtein distance (optimal string alignment variant)
+    between two given strings (s1 and s2). Originally based on code from
+    https://www.guyrutenberg.com/2008/12/15/damerau-levenshtein-distance-in-python/
+
+    Only the last three rows of the matrix are kept. If max_distance is given, only
+    cells within max_distance of the diagonal are computed, and as soon as the
+    distance is known to exceed max_distance, max_distance + 1 is returned.
+    """
+    len1 = len(s1)
+    len2 = len(s2)
+    if max_distance is None:
+        band = cap = max(len1, len2)
+    else:
+        if abs(len1 - len2) > max_distance:
+            return max_distance + 1
+        band = max_distance
+        cap = max_distance + 1
+    # Row i holds distances between s1[:i] and each prefix of s2, capped at cap.
+    # Cells outside the band are really >= cap, so they start out as cap.
+    prev2 = None
+    prev = [min(j, cap) for j in range(len2 + 1)]
+    prev_min = 0
+    for i in range(1, len1 + 1):
+        cur = [cap] * (len2 + 1)
+        cur[0] = min(i, cap)
+        row_min = cur[0]
+        c1 = s1[i - 1]
+        for j in range(max(1, i - band), min(len2, i + band) + 1):
+            cost = 0 if c1 == s2[j - 1] else 1
+            d = min(prev[j] + 1,  # deletion
+                    cur[j - 1] + 1,  # insertion
+                    prev[j - 1] + cost)  # substitution
+            if i > 1 and j > 1 and c1 == s2[j - 2] and s1[i - 2] == s2[j - 1]:
+                d = min(d, prev2[j - 2] + cost)  # transposition
+            if d > cap:
+                d = cap
+            cur[j] = d
+            if d < row_min:
+                row_min = d
+        # Every cell is derived from the two rows above it, so once both of them
+        # are past the limit, nothing below them can come back under it.
+        if row_min >= cap and prev_min >= cap and max_distance is not None:
+            return cap
+        prev2, prev, prev_min = prev, cur, row_min
+    return prev[len2]
+
+
+def edit_distances(tag, tags, max_distance=None):
+    """
+    Return the edit distance from tag to each of tags, in order. See
+    _damerau_levenshtein_distance() for how max_distance limits the work.
+    """
+    key = _distance_key(tag)
+    return [_damerau_levenshtein_distance(key, _distance_key(t), max_distance) for t in tags]
+
+
+def _unrestricted_damerau_levenshtein_distance(s1, s2, max_distance=None):
+    """
+    Compute the Damerau-Levenshtein distance between two strings, allowing
+    further edits between transposed chars (the Lowrance-Wagner algorithm).
+    Unlike _damerau_levenshtein_distance(), this is a true metric.
+
+    A transposition can reach back to the last row where some char appeared, so
+    only those rows and the one above are kept. If max_distance is given, only
+    cells within max_distance of the diagonal are computed, rows further back
+    than that are dropped, and any distance over max_distance comes back as
+    max_distance + 1.
+    """
+    len1 = len(s1)
+    len2 = len(s2)
+    if max_distance is None:
+        band = cap = len1 + len2
+    else:
+        if abs(len1 - len2) > max_distance:
+            return max_distance + 1
+        band = max_distance
+        cap = max_distance + 1
+    # rows[i] holds the distances between s1[:i] and each prefix of s2, capped at
+    # cap. Cells outside the band are really >= cap, so they start out as cap.
+    rows = {0: [min(j, cap) for j in range(len2 + 1)]}
+    last_row = {}
+    for i in range(1, len1 + 1):
+        prev = rows[i - 1]
+        cur = [cap] * (len2 + 1)
+        cur[0] = min(i, cap)
+        c1 = s1[i - 1]
+        last_match_col = 0
+        for j in range(1, len2 + 1):
+            c2 = s2[j - 1]
+            i1 = last_row.get(c2, 0)
+            j1 = last_match_col
+            if c1 == c2:
                 cost = 0
+                last_match_col = j
             else:
                 cost = 1
-            d[(i,j)] = min(
-                           d[(i-1,j)] + 1, # deletion
-                           d[(i,j-1)] + 1, # insertion
-                           d[(i-1,j-1)] + cost, # substitution
-                          )
-            if i and j and s1[i]==s2[j-1] and s1[i-1] == s2[j]:
-                d[(i,j)] = min (d[(i,j)], d[i-2,j-2] + cost) # transposition
-
-    return d[lenstr1-1,lenstr2-1]
\ No newline at end of file
+            if abs(i - j) > band:
+                continue
+            d = min(prev[j - 1] + cost,  # substitution
+                    cur[j - 1] + 1,  # insertion
+                    prev[j] + 1)  # deletion
+            if i1 and j1:
+                before = rows.get(i1 - 1)
+                if before is not None:
+                    d = min(d, before[j1 - 1] + (i - i1 - 1) + 1 + (j - j1 - 1))  # transposition
+            cur[j] = d if d < cap else cap
+        last_row[c1] = i
+        rows[i] = cur
+        # Keep the row above the next one, and the rows a transposition can
+        # still reach back to.
+        keep = set(r - 1 for r in last_row.values() if i - r < cap)
+        keep.add(i)
+        for r in [r for r in rows if r not in keep]:
+            del rows[r]
+    return rows[len1][len2]
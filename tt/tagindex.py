@@ -0,0 +1,191 @@
+"""
+A corpus-wide index from each tag to the set of term pages that carry it, so tag
+selection expressions can be answered without touching the pages themselves.
+
+Each page in the index gets a small integer id, and each tag maps to a bitmap
+(a python int) with one bit set per page id. Expressions are evaluated with
+bitwise and, or and not over those bitmaps.
+"""
+import json
+import os
+
+from . import cache
+from .tag import normalize, BKTree
+from .tagsel import BinaryExpr, GroupedExpr
+
+# Bump this whenever the shape of the saved index changes.
+INDEX_VERSION = 1
+
+
+def index_path():
+    return os.path.join(cache.CACHE_PATH, 'tagindex.json')
+
+
+class PageEntry:
+    """
+    What the index knows about one page. Pages that aren't terms are remembered
+    (with no fragment, term or tags) only so they aren't re-read every time.
+    """
+    def __init__(self, wiki, rel_path, key, fragment, term, tags):
+        self.wiki = wiki
+        self.rel_path = rel_path
+        self.key = key
+        self.fragment = fragment
+        self.term = term
+        self.tags = tags
+
+    def to_json(self):
+        return [self.wiki, self.rel_path, self.key, self.fragment, self.term, self.tags]
+
+
+class TagIndex:
+    def __init__(self):
+        # Page ids index into this list. Slots of removed pages are None until reused.
+        self.entries = []
+        self.bitmaps = {}
+        self.all = 0
+        self._by_path = {}
+        self._free = []
+        self._tag_tree = None
+
+    def __len__(self):
+        return bin(self.all).count('1')
+
+    @property
+    def tags(self):
+        return self.bitmaps.keys()
+
+    def add(self, entry):
+        if self._free:
+            page_id = self._free.pop()
+            self.entries[page_id] = entry
+        else:
+            page_id = len(self.entries)
+            self.entries.append(entry)
+        bit = 1 << page_id
+        for t in entry.tags:
+            if t not in self.bitmaps:
+                self._tag_tree = None
+            self.bitmaps[t] = self.bitmaps.get(t, 0) | bit
+        if entry.term is not None:
+            self.all |= bit
+        self._by_path[(entry.wiki, entry.rel_path)] = page_id
+        return page_id
+
+    def remove(self, wiki, rel_path):
+        page_id = self._by_path.pop((wiki, rel_path))
+        entry = self.entries[page_id]
+        mask = ~(1 << page_id)
+        for t in entry.tags:
+            b = self.bitmaps[t] & mask
+            if b:
+                self.bitmaps[t] = b
+            else:
+                del self.bitmaps[t]
+                self._tag_tree = None
+        self.all &= mask
+        self.entries[page_id] = None
+        self._free.append(page_id)
+
+    def update(self, wikis):
+        """
+        Bring the index up to date with the local clones of wikis, re-reading only
+        pages that were added or changed since they were last indexed. Pages of
+        wikis that aren't listed are dropped. Return how many pages changed.
+        """
+        changes = 0
+        seen = set()
+        for w in wikis:
+            for page in w.walk():
+                rel_path = w.rel_path(page.path)
+                key = cache.file_key(page.path)
+                seen.add((w.repo_name, rel_path))
+                page_id = self._by_path.get((w.repo_name, rel_path))
+                if page_id is not None:
+                    if self.entries[page_id].key == key:
+                        continue
+                    self.remove(w.repo_name, rel_path)
+                changes += 1
+                if page.is_term:
+                    self.add(PageEntry(w.repo_name, rel_path, key, page.fragment, page.term,
+                                       sorted(set(normalize(t) for t in page.tags))))
+                else:
+                    # Remember non-terms too, so they aren't re-read next time.
+                    self.add(PageEntry(w.repo_name, rel_path, key, None, None, []))
+            w.cache.save()
+        for path in [p for p in self._by_path if p not in seen]:
+            self.remove(*path)
+            changes += 1
+        return changes
+
+    def suggest(self, tag):
+        """
+        Return known tags that tag might be a misspelling of, closest first.
+        """
+        if self._tag_tree is None:
+            self._tag_tree = BKTree(self.bitmaps)
+        return [t for d, t in self._tag_tree.find(tag) if t != tag]
+
+    def evaluate(self, expr):
+        """
+        Return the bitmap of the pages matched by a parsed tagsel expression.
+        """
+        if isinstance(expr, BinaryExpr):
+            lhs = self.evaluate(expr.lhs)
+            rhs = self.evaluate(expr.rhs)
+            b = (lhs & rhs) if expr.operator == 'and' else (lhs | rhs)
+        elif isinstance(expr, GroupedExpr):
+            b = self.evaluate(expr.expr)
+        else:
+            b = self.bitmaps.get(expr.value, 0)
+        return (self.all & ~b) if expr.negated else b
+
+    def select(self, expr):
+        """
+        Return the entries of the term pages matched by a parsed tagsel expression.
+        """
+        b = self.evaluate(expr)
+        found = []
+        while b:
+            low_bit = b & -b
+            found.append(self.entries[low_bit.bit_length() - 1])
+            b ^= low_bit
+        return found
+
+    def save(self, path=None):
+        path = path or index_path()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = path + '.tmp'
+        with open(tmp, 'wt') as f:
+            json.dump({
+                'version': INDEX_VERSION,
+                'entries': [e.to_json() if e else None for e in self.entries],
+                'bitmaps': {t: format(b, 'x') for t, b in self.bitmaps.items()},
+            }, f)
+        os.replace(tmp, path)
+
+
+def load(path=None):
+    """
+    Load the saved index, or return an empty one if there isn't a usable one.
+    """
+    idx = TagIndex()
+    try:
+        with open(path or index_path(), 'rt') as f:
+            saved = json.load(f)
+        if saved.get('version') != INDEX_VERSION:
+            return idx
+        for page_id, e in enumerate(saved['entries']):
+            if e:
+                entry = PageEntry(*e)
+                idx.entries.append(entry)
+                idx._by_path[(entry.wiki, entry.rel_path)] = page_id
+                if entry.term is not None:
+                    idx.all |= 1 << page_id
+            else:
+                idx.entries.append(None)
+                idx._free.append(page_id)
+        idx.bitmaps = {t: int(b, 16) for t, b in saved['bitmaps'].items()}
+    except (OSError, ValueError, KeyError, TypeError):
+        idx = TagIndex()
+    return idx
@@ -1,4 +1,5 @@
 import re
+import threading
 
 
 from .tag import normalize
@@ -198,3 +199,116 @@ def parse(expr):
         raise BadExpression("Incomplete expression.")
     return parser.expr
 
+
+
+def expr_tags(expr):
+    """
+    Yield each tag that a parsed expression refers to.
+    """
+    if isinstance(expr, BinaryExpr):
+        yield from expr_tags(expr.lhs)
+        yield from expr_tags(expr.rhs)
+    elif isinstance(expr, GroupedExpr):
+        yield from expr_tags(expr.expr)
+    else:
+        yield expr.value
+
+
+# Ids of normalized tags, and (as a shortcut) of each spelling seen so far.
+_TAG_IDS = {}
+_SPELLINGS = {}
+# Pages are read and rendered on several threads, which must not hand out the
+# same id to two tags.
+_TAG_IDS_LOCK = threading.Lock()
+
+
+def tag_id(tag):
+    """
+    Return a small int that stands for a tag. Tags are normalized first, the same
+    way expressions and the tag index normalize them, so every spelling of a tag
+    gets the same id.
+    """
+    i = _SPELLINGS.get(tag)
+    if i is None:
+        normalized = normalize(tag)
+        with _TAG_IDS_LOCK:
+            i = _TAG_IDS.setdefault(normalized, len(_TAG_IDS))
+            _SPELLINGS[tag] = i
+    return i
+
+
+def tag_ids(tags):
+    """
+    Turn a list of tags into the form that compiled expressions test.
+    """
+    return frozenset(tag_id(t) for t in tags)
+
+
+def _to_nnf(expr, negated=False):
+    """
+    Rewrite an expression tree as nested ('and'|'or', [children]) tuples whose leaves
+    are (tag_id, negated) pairs. Negations are pushed down to the leaves with De
+    Morgan's laws, and nested operators of the same kind are flattened.
+    """
+    negated = negated != expr.negated
+    if isinstance(expr, ValueExpr):
+        return tag_id(expr.value), negated
+    if isinstance(expr, GroupedExpr):
+        return _to_nnf(expr.expr, negated)
+    operator = expr.operator
+    if negated:
+        operator = 'or' if operator == 'and' else 'and'
+    children = []
+    for side in (expr.lhs, expr.rhs):
+        child = _to_nnf(side, negated)
+        if child[0] == operator:
+            children += child[1]
+        else:
+            children.append(child)
+    return operator, children
+
+
+def _always(tags):
+    return True
+
+
+def _never(tags):
+    return False
+
+
+def _compile_nnf(node):
+    if node[0] not in ('and', 'or'):
+        i, negated = node
+        if negated:
+            return lambda tags: i not in tags
+        return lambda tags: i in tags
+
+    operator, children = node
+    present = frozenset(child[0] for child in children if child[1] is False)
+    absent = frozenset(child[0] for child in children if child[1] is True)
+    others = [_compile_nnf(child) for child in children if child[0] in ('and', 'or')]
+    # "#a and not #a" can never match; "#a or not #a" always does.
+    if present & absent:
+        return _never if operator == 'and' else _always
+
+    if operator == 'and':
+        if not others:
+            if not absent:
+                return lambda tags: present <= tags
+            if not present:
+                return lambda tags: absent.isdisjoint(tags)
+        return lambda tags: (present <= tags and absent.isdisjoint(tags)
+                             and all(f(tags) for f in others))
+    if not others and not absent:
+        return lambda tags: not present.isdisjoint(tags)
+    return lambda tags: (not present.isdisjoint(tags) or (absent and not absent <= tags)
+                         or any(f(tags) for f in others))
+
+
+def compile_expr(expr):
+    """
+    Compile a parsed expression into a function that takes a frozenset of tag ids
+    (see tag_ids()) and returns whether it matches. This is much faster than
+    expr.matches() when the same expression is tested against many pages.
+    """
+    return _compile_nnf(_to_nnf(expr))
@@ -1,5 +1,105 @@
+import pytest
+
 from ..git import *
+from . import gitrepo
 
 
 def test_is_installed():
-    assert VERSION_PAT.match(is_installed())
\ No newline at end of file
+    assert VERSION_PAT.match(is_installed())
+
+def test_get_histories(tmp_path):
+    folder = gitrepo.init(str(tmp_path))
+    gitrepo.commit(folder, {'a.md': 'x', 'b.md': 'y'}, author='Alice', timestamp=1000)
+    h = gitrepo.commit(folder, {'a.md': 'z'}, author='Bob', timestamp=2000)
+    histories = get_histories(folder)
+    assert sorted(histories.keys()) == ['a.md', 'b.md']
+    assert [e[1:] for e in histories['a.md']] == [('Bob', 2000), ('Alice', 1000)]
+    assert h.startswith(histories['a.md'][0][0])
+    assert [e[1:] for e in histories['b.md']] == [('Alice', 1000)]
+
+
+def test_get_history_matches_get_histories(tmp_path):
+    folder = gitrepo.init(str(tmp_path))
+    gitrepo.commit(folder, {'a.md': 'x'}, timestamp=1000)
+    gitrepo.commit(folder, {'a.md': 'y'}, timestamp=2000)
+    assert get_history(os.path.join(folder, 'a.md')) == get_histories(folder)['a.md']
+
+
+def test_clone_and_pull_leave_cwd_alone(tmp_path):
+    remote = gitrepo.make_remote(str(tmp_path / 'remote.git'), {'a.md': 'x'})
+    local = str(tmp_path / 'local')
+    cwd = os.getcwd()
+    clone(remote, local)
+    assert os.path.isfile(os.path.join(local, 'a.md'))
+    gitrepo.push(remote, {'b.md': 'y'})
+    pull(local)
+    assert os.path.isfile(os.path.join(local, 'b.md'))
+    assert os.getcwd() == cwd
+
+
+def test_partial_clone_with_reference(tmp_path):
+    remote = gitrepo.make_remote(str(tmp_path / 'remote.git'), {'a.md': 'x'})
+    gitrepo.git(remote, 'config', 'uploadpack.allowFilter', 'true')
+    mirror = str(tmp_path / 'mirror.git')
+    gitrepo.git(str(tmp_path), 'clone', '-q', '--mirror', remote, mirror)
+    local = str(tmp_path / 'local')
+    clone('file://' + remote, local, filter='blob:none', reference=mirror)
+    assert os.path.isfile(os.path.join(local, 'a.md'))
+    assert gitrepo.git(local, 'config', 'remote.origin.partialclonefilter') == 'blob:none'
+    with open(os.path.join(local, '.git/objects/info/alternates'), 'rt') as f:
+        assert f.read().strip() == os.path.join(mirror, 'objects')
+    # A reference that doesn't exist is skipped.
+    clone(remote, str(tmp_path / 'local2'), reference=str(tmp_path / 'nope.git'))
+
+
+def test_remote_head_and_fetch(tmp_path):
+    remote = gitrepo.make_remote(str(tmp_path / 'remote.git'), {'a.md': 'x'})
+    local = str(tmp_path / 'local')
+    clone(remote, local)
+    assert remote_head(local) == get_head(local)
+    # Rewrite the remote's history, which pull --ff-only can't follow.
+    work = remote + '.work'
+    gitrepo.git(work, 'commit', '-q', '--amend', '-m', 'rewritten')
+    gitrepo.git(work, 'push', '-q', '-f', 'origin', 'HEAD:main')
+    assert remote_head(local) != get_head(local)
+    with pytest.raises(Exception):
+        pull(local)
+    with open(os.path.join(local, 'b.md'), 'wt') as f:
+        f.write('local edit')
+    fetch(local)
+    assert get_head(local) == remote_head(local) == gitrepo.git(work, 'rev-parse', 'HEAD')
+    assert os.path.isfile(os.path.join(local, 'b.md'))
+
+
+def test_list_and_read_blobs(tmp_path):
+    folder = gitrepo.init(str(tmp_path))
+    os.mkdir(os.path.join(folder, 'sub'))
+    old = gitrepo.commit(folder, {'a.md': 'x\n', 'sub/b c.md': 'y'})
+    gitrepo.commit(folder, {'a.md': 'z'})
+    blobs = dict(list_blobs(folder, old))
+    assert sorted(blobs) == ['a.md', 'sub/b c.md']
+    reader = BlobReader(folder)
+    try:
+        assert reader.read(blobs['a.md']) == b'x\n'
+        assert reader.read(blobs['sub/b c.md']) == b'y'
+        with pytest.raises(Exception):
+            reader.read('0' * 40)
+    finally:
+        reader.close()
+
+
+def test_remote_head_follows_upstream(tmp_path):
+    remote = gitrepo.make_remote(str(tmp_path / 'remote.git'), {'a.md': 'x'})
+    work = remote + '.work'
+    gitrepo.git(work, 'checkout', '-q', '-b', 'draft')
+    draft = gitrepo.commit(work, {'b.md': 'y'})
+    gitrepo.git(work, 'push', '-q', 'origin', 'draft')
+    local = str(tmp_path / 'local')
+    clone(remote, local)
+    gitrepo.git(local, 'checkout', '-q', 'draft')
+    assert remote_head(local) == get_head(local) == draft
+    # A branch with no upstream that's listed before the checked out one.
+    gitrepo.git(local, 'branch', 'aaa-scratch')
+    assert remote_head(local) == draft
+    gitrepo.git(local, 'checkout', '-q', '--detach')
+    assert remote_head(local) is None
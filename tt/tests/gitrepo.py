@@ -0,0 +1,81 @@
+"""
+Helpers that build throwaway git repos for tests, so tests that exercise git
+behavior don't need network access.
+"""
+import os
+import subprocess
+
+AUTHOR_ENV = {
+    'GIT_AUTHOR_NAME': 'Alice',
+    'GIT_AUTHOR_EMAIL': 'alice@example.com',
+    'GIT_COMMITTER_NAME': 'Alice',
+    'GIT_COMMITTER_EMAIL': 'alice@example.com',
+}
+
+
+def git(folder, *args, **env):
+    e = dict(os.environ)
+    e.update(AUTHOR_ENV)
+    e.update(env)
+    proc = subprocess.run(['git', '-C', folder] + list(args), env=e, capture_output=True, check=True)
+    return proc.stdout.decode('utf-8').strip()
+
+
+def init(folder):
+    os.makedirs(folder, exist_ok=True)
+    git(folder, 'init', '-q', '-b', 'main')
+    return folder
+
+
+def commit(folder, files, author='Alice', timestamp=None, message='update'):
+    """
+    Write each fname -> text pair in files (text of None deletes the file),
+    then commit as the given author.
+    """
+    for fname, text in files.items():
+        path = os.path.join(folder, fname)
+        if text is None:
+            os.remove(path)
+        else:
+            with open(path, 'wt') as f:
+                f.write(text)
+    env = {'GIT_AUTHOR_NAME': author}
+    if timestamp is not None:
+        env['GIT_AUTHOR_DATE'] = env['GIT_COMMITTER_DATE'] = '@%d +0000' % timestamp
+    git(folder, 'add', '-A')
+    git(folder, 'commit', '-q', '-m', message, **env)
+    return git(folder, 'rev-parse', 'HEAD')
+
+
+def make_remote(folder, files):
+    """
+    Create a bare repo at folder, holding a single commit with the given files.
+    It can then be cloned or pulled like a repo on github.
+    """
+    git(os.path.dirname(folder) or '.', 'init', '-q', '--bare', '-b', 'main', folder)
+    work = folder + '.work'
+    git(os.path.dirname(folder) or '.', 'clone', '-q', folder, work)
+    commit(work, files)
+    git(work, 'push', '-q', 'origin', 'HEAD:main')
+    return folder
+
+
+def push(remote, files, **kwargs):
+    """
+    Commit another change to a repo created by make_remote().
+    """
+    work = remote + '.work'
+    git(work, 'pull', '-q', 'origin', 'main')
+    h = commit(work, files, **kwargs)
+    git(work, 'push', '-q', 'origin', 'HEAD:main')
+    return h
+
+
+def make_wiki(wiki, files, remotes_folder):
+    """
+    Make wiki look like it has already been cloned, from a local remote holding
+    the given files, so that refreshing it works offline.
+    """
+    remote = make_remote(os.path.join(remotes_folder, wiki.repo_name + '.git'), files)
+    git(os.path.dirname(remote), 'clone', '-q', remote, wiki.folder)
+    return remote
@@ -1,7 +1,14 @@
+import gc
 import io
+import os
 import json
+import pytest
+import shutil
 
+from .. import cache
+from .. import timing
 from ..glossary import *
+from . import gitrepo
 
 SAMPLE_GLOSSARY_CFG = json.loads("""{
     "title": "My Simple Glossary",
@@ -55,3 +62,349 @@ def test_subset_in_config():
     g2 = Glossary(SAMPLE_GLOSSARY_SUBSET_CFG)
     y = g2.render()
     assert len(x) > len(y)
+
+
+@pytest.fixture
+def local_wiki(tmp_path, monkeypatch):
+    """
+    A terms wiki named local-terms, cloned into a scratch corpus from a local remote.
+    Other wikis can be "cloned from github" by creating remotes for them in the
+    remotes folder.
+    """
+    monkeypatch.setattr(tw, 'LOCAL_PATH', str(tmp_path / 'corpus'))
+    monkeypatch.setattr(cache, 'CACHE_PATH', str(tmp_path / 'cache'))
+    remotes = tmp_path / 'remotes'
+    remotes.mkdir()
+    monkeypatch.setitem(tw.GIT_ENV, 'GIT_CONFIG_COUNT', '1')
+    monkeypatch.setitem(tw.GIT_ENV, 'GIT_CONFIG_KEY_0', 'url.file://%s/.insteadOf' % remotes)
+    monkeypatch.setitem(tw.GIT_ENV, 'GIT_CONFIG_VALUE_0', 'https://github.com/trustoverip/')
+    wiki = tw.TermsWiki('local-terms')
+    gitrepo.make_wiki(wiki, {
+        'alpha.md': '## Definition\nThe first. Comes before [beta](beta).\n\n## Tags\n#greek\n',
+        'beta.md': '## Definition\nThe second. See [gamma](gamma).\n',
+        'Home.md': 'Not a term.\n',
+        'Delta-Wing-(DW).md': '## Definition\nA triangular wing.\n',
+    }, str(remotes))
+    return wiki
+
+
+LOCAL_GLOSSARY_CFG = {"title": "Local", "sources": [{"wiki": "local-terms"}]}
+
+
+def test_hover_text_on_links(local_wiki, capsys):
+    txt = Glossary(LOCAL_GLOSSARY_CFG).render()
+    assert '<a href="#beta" title="The second.">beta</a>' in txt
+    # gamma isn't in the glossary, so the link to it is broken.
+    assert '<a href="#gamma">gamma</a>' in txt
+    assert 'Broken hyperlink to #gamma' in capsys.readouterr().err
+    assert 'Not a term' not in txt
+
+
+def test_hover_text_replaces_link_title(local_wiki):
+    gitrepo.commit(local_wiki.folder, {
+        'epsilon.md': '## Definition\nThe fifth. Like [beta](beta "its own title") and <a href="#beta">beta</a>.\n'})
+    # The second time, the page comes from the cache.
+    for cached in (False, True):
+        g = Glossary(LOCAL_GLOSSARY_CFG)
+        assert g.fix_hyperlinks(g.find_page('epsilon')) == ('<p>The fifth. Like <a href="#beta" title="The second.">beta</a> and '
+                        '<a href="#beta">beta</a>.</p>\n'), cached
+
+
+def test_find_page(local_wiki):
+    g = Glossary(LOCAL_GLOSSARY_CFG)
+    assert [p.fragment for p in g.pages] == ['alpha', 'beta', 'delta-wing-dw']
+    assert g.find_page('beta').term == 'beta'
+    assert g.find_page('home') is None
+    assert g.find_acronym('dw').term == 'Delta Wing (DW)'
+    assert g.find_acronym('xyz') is None
+
+
+def test_refresh_all_sources(local_wiki, tmp_path):
+    gitrepo.make_remote(str(tmp_path / 'remotes/other-terms.wiki.git'), {'omega.md': '## Definition\nThe last.\n'})
+    gitrepo.push(str(tmp_path / 'remotes/local-terms.wiki.git'), {'gamma.md': '## Definition\nThe third.\n'})
+
+    g = Glossary({"sources": [{"wiki": "local-terms"}, {"wiki": "other-terms"}]})
+    assert [p.fragment for p in g.pages] == ['alpha', 'beta', 'delta-wing-dw', 'gamma', 'omega']
+
+
+def test_refresh_by_fetch(local_wiki, tmp_path):
+    remote = str(tmp_path / 'remotes/local-terms.wiki.git')
+    gitrepo.git(remote + '.work', 'commit', '-q', '--amend', '-m', 'rewritten')
+    gitrepo.git(remote + '.work', 'push', '-q', '-f', 'origin', 'HEAD:main')
+    gitrepo.push(remote, {'gamma.md': '## Definition\nThe third.\n'})
+    g = Glossary({"git": {"refresh": "fetch"}, "sources": [{"wiki": "local-terms"}]})
+    assert [p.fragment for p in g.pages] == ['alpha', 'beta', 'delta-wing-dw', 'gamma']
+    with pytest.raises(Exception):
+        Glossary({"git": {"refresh": "merge"}, "sources": [{"wiki": "local-terms"}]})
+
+
+def test_shared_wiki_git_settings_must_agree(local_wiki):
+    wikis = {}
+    g = Glossary({"git": {"refresh": "fetch"}, "sources": [{"wiki": "local-terms"}]}, wikis=wikis)
+    # A source can give the same settings itself.
+    Glossary({"sources": [{"wiki": "local-terms", "git": {"refresh": "fetch"}}]}, wikis=wikis)
+    assert g.sources[0].wiki.fetch_only
+    # Leaving a setting out asks for its default, which is a different setting.
+    with pytest.raises(Exception) as e:
+        Glossary({"sources": [{"wiki": "local-terms"}]}, wikis=wikis)
+    assert 'Conflicting git settings' in str(e.value) and '"refresh" is both "fetch" and "pull"' in str(e.value)
+    with pytest.raises(Exception) as e:
+        Glossary({"git": {"refresh": "fetch", "filter": "blob:none"}, "sources": [{"wiki": "local-terms"}]},
+                 wikis=wikis)
+    assert '"filter" is both unset and "blob:none"' in str(e.value)
+    # Spelling out the default is the same as leaving it out.
+    wikis = {}
+    Glossary({"sources": [{"wiki": "local-terms"}]}, wikis=wikis)
+    Glossary({"git": {"refresh": "pull"}, "sources": [{"wiki": "local-terms"}]}, wikis=wikis)
+
+
+def test_refresh_reports_all_failures(local_wiki):
+    g = Glossary({"sources": [{"wiki": "local-terms"}, {"wiki": "missing1-terms"}, {"wiki": "missing2-terms"}]})
+    with pytest.raises(RefreshError) as e:
+        g.refresh()
+    assert [url for url, _ in e.value.errors] == [
+        'https://github.com/trustoverip/missing1-terms.wiki.git',
+        'https://github.com/trustoverip/missing2-terms.wiki.git']
+
+
+def test_parallel_render_matches_serial(local_wiki, tmp_path):
+    parallel = Glossary(LOCAL_GLOSSARY_CFG, jobs=2).render()
+    shutil.rmtree(str(tmp_path / 'cache'))
+    serial = Glossary(LOCAL_GLOSSARY_CFG).render()
+    assert parallel == serial
+
+
+def test_render_to_frame(local_wiki, tmp_path):
+    frame = tmp_path / 'frame.html'
+    frame.write_text('<body>%nav<div>%main</div></body>')
+    g = Glossary({"frame": str(frame), "sources": [{"wiki": "local-terms"}]})
+    out = io.StringIO()
+    g.render_to(out)
+    txt = out.getvalue()
+    assert txt == g.render()
+    assert txt.startswith('<body><nav>[ <a href="#A">A</a> <a href="#B">B</a> C ')
+    assert ']</nav>\n<div><dl id="glossary_content">' in txt
+    assert txt.endswith('</dl>\n</div></body>')
+
+
+def test_subset_of_local_wiki(local_wiki):
+    g = Glossary({"sources": [{"wiki": "local-terms", "subset": "#greek or not #local"}]})
+    assert [p.fragment for p in g.pages] == ['alpha']
+
+
+def test_suggest_misspelled_tags(local_wiki, tmp_path, capsys):
+    gitrepo.push(str(tmp_path / 'remotes/local-terms.wiki.git'), {
+        'epsilon.md': '## Definition\nThe fifth.\n\n## Tags\n#greke\n',
+        'zeta.md': '## Definition\nThe sixth.\n\n## Tags\n#greek\n',
+    })
+    g = Glossary({"sources": [{"wiki": "local-terms", "subset": "not #grek"}]})
+    assert len(g.pages) == 5
+    err = capsys.readouterr().err
+    assert 'No page in the glossary is tagged #grek. Did you mean #greek or #greke?' in err
+    assert 'epsilon.md is the only page tagged #greke. Did you mean #greek?' in err
+
+
+def test_tag_warnings_once_per_wiki(local_wiki, tmp_path, capsys):
+    gitrepo.push(str(tmp_path / 'remotes/local-terms.wiki.git'), {
+        'epsilon.md': '## Definition\nThe fifth.\n\n## Tags\n#greke\n',
+        'zeta.md': '## Definition\nThe sixth.\n\n## Tags\n#greek\n',
+    })
+    wikis = {}
+    for subset in ['#greek', '#local']:
+        Glossary({"sources": [{"wiki": "local-terms", "subset": subset}]}, wikis=wikis).render()
+    assert capsys.readouterr().err.count('is the only page tagged #greke') == 1
+
+
+def test_profile(local_wiki):
+    timing.enable()
+    try:
+        Glossary(LOCAL_GLOSSARY_CFG).render()
+        r = timing.report()
+    finally:
+        timing.disable()
+    for stage in ['TermsWiki.refresh', 'TermsWiki.pages', 'Page.ast', 'Page.history',
+                  'Glossary.fix_hyperlinks', 'Glossary.render']:
+        assert stage in r['stages']
+    # The remote hasn't moved, so no pull: finding the upstream branch, one
+    # ls-remote and one rev-parse to see that, one check for a manifest, and one
+    # git log for the history of the whole wiki.
+    assert r['counters']['refreshes skipped'] == 1
+    assert r['counters']['subprocesses'] == 5
+    assert r['stages']['Page.ast']['calls'] == 4
+
+
+def test_glossaries_share_wikis(local_wiki, tmp_path):
+    gitrepo.make_remote(str(tmp_path / 'remotes/other-terms.wiki.git'), {'omega.md': '## Definition\nThe last.\n'})
+    wikis = {}
+    greek = Glossary({"sources": [{"wiki": "local-terms", "subset": "#greek"}]}, wikis=wikis)
+    both = Glossary({"sources": [{"wiki": "local-terms"}, {"wiki": "other-terms"}]}, wikis=wikis)
+    assert list(wikis) == ['https://github.com/trustoverip/local-terms.wiki.git',
+                           'https://github.com/trustoverip/other-terms.wiki.git']
+    assert greek.sources[0].wiki is both.sources[0].wiki
+    timing.enable()
+    try:
+        greek.render()
+        both.render()
+        r = timing.report()
+    finally:
+        timing.disable()
+    # Each wiki is pulled or cloned once, and each page parsed once.
+    assert r['stages']['TermsWiki.refresh']['calls'] == 2
+    assert r['stages']['Page.ast']['calls'] == 5
+    assert [p.fragment for p in greek.pages] == ['alpha']
+    assert [p.fragment for p in both.pages] == ['alpha', 'beta', 'delta-wing-dw', 'omega']
+    assert greek.pages[0] is both.pages[0]
+
+
+def test_render_from_manifest(local_wiki, tmp_path, monkeypatch):
+    expected = Glossary(LOCAL_GLOSSARY_CFG).render()
+    assert local_wiki.write_manifest() == 3
+
+    def fail(*args):
+        raise AssertionError('should have used the manifest')
+    (tmp_path / 'cache/local-terms.wiki.json').unlink()
+    with monkeypatch.context() as m:
+        m.setattr(tw.markdown, 'parse', fail)
+        m.setattr(tw, 'get_histories', fail)
+        assert Glossary(LOCAL_GLOSSARY_CFG).render() == expected
+
+    # Once HEAD moves, the pages are read again.
+    gitrepo.push(str(tmp_path / 'remotes/local-terms.wiki.git'), {'gamma.md': '## Definition\nThe third.\n'})
+    g = Glossary(LOCAL_GLOSSARY_CFG)
+    assert [p.fragment for p in g.pages] == ['alpha', 'beta', 'delta-wing-dw', 'gamma']
+
+
+def test_manifest_sees_local_edits(local_wiki):
+    local_wiki.write_manifest()
+    with open(os.path.join(local_wiki.folder, 'beta.md'), 'wt') as f:
+        f.write('## Definition\nThe runner-up.\n')
+    with open(os.path.join(local_wiki.folder, 'gamma.md'), 'wt') as f:
+        f.write('## Definition\nThe third.\n')
+    os.remove(os.path.join(local_wiki.folder, 'alpha.md'))
+    txt = Glossary(LOCAL_GLOSSARY_CFG).render()
+    assert 'The runner-up.' in txt and 'The second.' not in txt
+    assert 'id="gamma"' in txt and 'id="alpha"' not in txt
+
+    # A manifest written while pages are edited leaves them out, so they're
+    # still read from their files once they're put back.
+    assert local_wiki.write_manifest() == 1
+    gitrepo.git(local_wiki.folder, 'checkout', '--', '.')
+    os.remove(os.path.join(local_wiki.folder, 'gamma.md'))
+    g = Glossary(LOCAL_GLOSSARY_CFG)
+    assert [p.fragment for p in g.pages] == ['alpha', 'beta', 'delta-wing-dw']
+    assert 'The second.' in g.render()
+
+
+def test_render_at_rev(local_wiki, tmp_path):
+    expected = Glossary(LOCAL_GLOSSARY_CFG).render()
+    gitrepo.git(local_wiki.folder, 'tag', 'v1')
+    gitrepo.push(str(tmp_path / 'remotes/local-terms.wiki.git'), {
+        'gamma.md': '## Definition\nThe third.\n', 'beta.md': None})
+    g = Glossary(LOCAL_GLOSSARY_CFG)
+    assert [p.fragment for p in g.pages] == ['alpha', 'delta-wing-dw', 'gamma']
+    timing.enable()
+    try:
+        assert Glossary(LOCAL_GLOSSARY_CFG, at='v1').render() == expected
+        # Parsed blobs are cached, so the same revision is only parsed once.
+        assert Glossary(LOCAL_GLOSSARY_CFG, at='v1').render() == expected
+        assert timing.report()['stages']['Page.ast']['calls'] == 4
+    finally:
+        timing.disable()
+    # Nothing was checked out.
+    assert os.path.isfile(os.path.join(local_wiki.folder, 'gamma.md'))
+    assert not os.path.exists(os.path.join(local_wiki.folder, 'beta.md'))
+    with pytest.raises(RefreshError):
+        Glossary(LOCAL_GLOSSARY_CFG, at='v2').pages
+
+    # With every blob cached: one rev-parse, one ls-tree, and one git log.
+    timing.enable()
+    try:
+        g = Glossary(LOCAL_GLOSSARY_CFG, at='v1')
+        g.render()
+        assert timing.report()['counters']['subprocesses'] == 3
+    finally:
+        timing.disable()
+    # Reading a page after the build starts a git process, which goes away with the wiki.
+    assert g.pages[0].read().startswith('## Definition')
+    reader = g.sources[0].wiki._blobs
+    del g
+    gc.collect()
+    assert reader._proc is None
+
+
+def test_timeline(local_wiki, tmp_path):
+    gitrepo.git(local_wiki.folder, 'tag', 'v1')
+    gitrepo.push(str(tmp_path / 'remotes/local-terms.wiki.git'), {
+        'alpha.md': '## Definition\nThe very first.\n', 'beta.md': None, 'gamma.md': '## Definition\nThe third.\n'})
+    gitrepo.git(local_wiki.folder, 'pull', '-q')
+    gitrepo.git(local_wiki.folder, 'tag', 'v2')
+    gitrepo.git(local_wiki.folder, 'tag', 'not-a-release')
+    timing.enable()
+    try:
+        timeline = [(tag, g.render(), g.pages) for tag, g in build_timeline(LOCAL_GLOSSARY_CFG, 'v*')]
+        # Four pages, then two new blobs: alpha changed and gamma was added.
+        assert timing.report()['stages']['Page.ast']['calls'] == 6
+    finally:
+        timing.disable()
+    assert [tag for tag, html, pages in timeline] == ['v1', 'v2']
+    for tag, html, pages in timeline:
+        assert html == Glossary(LOCAL_GLOSSARY_CFG, at=tag).render()
+    assert diff_terms(timeline[0][2], timeline[1][2]) == (['gamma'], ['beta'], ['alpha'])
+
+
+def test_timeline_fetches_tags(local_wiki, tmp_path):
+    work = str(tmp_path / 'remotes/local-terms.wiki.git.work')
+    gitrepo.git(work, 'tag', 'v1')
+    gitrepo.git(work, 'push', '-q', 'origin', 'v1')
+    assert [tag for tag, g in build_timeline(LOCAL_GLOSSARY_CFG)] == ['v1']
+
+
+def test_update(local_wiki):
+    g = Glossary(LOCAL_GLOSSARY_CFG)
+    assert g.update() == 0
+    g.render()
+    assert g.update() == 0
+
+    with open(os.path.join(local_wiki.folder, 'beta.md'), 'wt') as f:
+        f.write('## Definition\nThe runner-up.\n')
+    with open(os.path.join(local_wiki.folder, 'gamma.md'), 'wt') as f:
+        f.write('## Definition\nThe third.\n')
+    os.remove(os.path.join(local_wiki.folder, 'Delta-Wing-(DW).md'))
+    assert g.update() == 3
+    # alpha links to beta, so it has to be rendered again with beta's new hover text.
+    assert g.render() == Glossary(LOCAL_GLOSSARY_CFG).render()
+    assert '<a href="#beta" title="The runner-up.">' in g.render()
+    assert g.find_acronym('dw') is None
+
+    # A commit can change the history of every page, Home.md included.
+    gitrepo.commit(local_wiki.folder, {}, author='Bob')
+    assert g.update() == 4
+    assert 'version 2, ' in g.render()
+
+    # Editors' lock files, which are dangling links, aren't pages.
+    os.symlink('bob@host.1234', os.path.join(local_wiki.folder, '.#alpha.md'))
+    assert g.update() == 0
+
+
+def test_update_saves_page_cache(local_wiki):
+    g = Glossary(LOCAL_GLOSSARY_CFG)
+    g.update()
+    with open(os.path.join(local_wiki.folder, 'beta.md'), 'wt') as f:
+        f.write('## Definition\nThe runner-up.\n')
+    assert g.update() == 1
+    timing.enable()
+    try:
+        Glossary(LOCAL_GLOSSARY_CFG).render()
+        assert 'Page.ast' not in timing.report()['stages']
+    finally:
+        timing.disable()
+
+
+def test_serial_build_saves_page_cache(local_wiki):
+    expected = Glossary(LOCAL_GLOSSARY_CFG).render()
+    timing.enable()
+    try:
+        assert Glossary(LOCAL_GLOSSARY_CFG).render() == expected
+        assert 'Page.ast' not in timing.report()['stages']
+    finally:
+        timing.disable()
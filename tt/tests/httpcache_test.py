@@ -0,0 +1,89 @@
+import http.server
+import threading
+
+import pytest
+
+from .. import cache
+from .. import httpcache
+
+FRAME = '<html><body>%nav %main</body></html>'
+
+
+class FrameHandler(http.server.BaseHTTPRequestHandler):
+    body = FRAME
+    etag = '"v1"'
+    requests = []
+
+    def do_GET(self):
+        FrameHandler.requests.append(dict(self.headers))
+        if self.headers.get('If-None-Match') == self.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        data = self.body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('ETag', self.etag)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server(tmp_path):
+    saved = cache.CACHE_PATH
+    cache.CACHE_PATH = str(tmp_path / 'cache')
+    FrameHandler.requests = []
+    FrameHandler.body = FRAME
+    httpd = http.server.HTTPServer(('127.0.0.1', 0), FrameHandler)
+    t = threading.Thread(target=httpd.serve_forever, args=(0.05,), daemon=True)
+    t.start()
+    try:
+        yield httpd
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+        cache.CACHE_PATH = saved
+
+
+def url_of(httpd):
+    return 'http://127.0.0.1:%d/frame.html' % httpd.server_address[1]
+
+
+def test_revalidates_with_etag(server):
+    url = url_of(server)
+    assert httpcache.fetch(url) == FRAME
+    assert 'If-None-Match' not in FrameHandler.requests[0]
+    # The server would send something else if asked unconditionally, so getting
+    # the original back proves a 304 was answered from the cache.
+    FrameHandler.body = 'changed'
+    assert httpcache.fetch(url) == FRAME
+    assert FrameHandler.requests[1]['If-None-Match'] == '"v1"'
+
+
+def test_fresh_copy_skips_network(server):
+    url = url_of(server)
+    httpcache.fetch(url)
+    assert httpcache.fetch(url, max_age=3600) == FRAME
+    assert len(FrameHandler.requests) == 1
+
+
+def test_offline(server):
+    url = url_of(server)
+    with pytest.raises(Exception):
+        httpcache.fetch(url, offline=True)
+    httpcache.fetch(url)
+    assert httpcache.fetch(url, offline=True) == FRAME
+    assert len(FrameHandler.requests) == 1
+
+
+def test_stale_copy_used_when_server_is_down(server, capsys):
+    url = url_of(server)
+    httpcache.fetch(url)
+    server.shutdown()
+    server.server_close()
+    assert httpcache.fetch(url, timeout=2) == FRAME
+    assert "Couldn't refresh" in capsys.readouterr().err
@@ -0,0 +1,21 @@
+import json
+import os
+import subprocess
+import sys
+
+PACKAGE_FOLDER = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Slow to import, and not needed until a page is parsed or a frame downloaded.
+DEFERRED_MODULES = ['marko', 'requests']
+
+
+def _modules_after_import(module):
+    code = "import json, sys; import %s; print(json.dumps(sorted(sys.modules)))" % module
+    out = subprocess.check_output([sys.executable, '-c', code], cwd=PACKAGE_FOLDER, text=True)
+    return json.loads(out)
+
+
+def test_heavy_imports_are_deferred():
+    for module in ['tt.app', 'tt.glossary', 'tt.tagindex']:
+        modules = _modules_after_import(module)
+        for m in DEFERRED_MODULES:
+            assert m not in modules, '%s imported %s' % (module, m)
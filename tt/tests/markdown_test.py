@@ -64,5 +64,19 @@ def test_section():
     assert '#tag3' in s.text
 
 
+def test_sections_by_fragment():
+    sections = markdown.split(markdown.parse(SAMPLE_PAGE))
+    assert list(sections.by_fragment) == [s.fragment for s in sections]
+    assert sections.by_fragment['tags'] is sections[3]
+    assert 'nothing' not in sections.by_fragment
+
+
+def test_reused_renderer_forgets_previous_document():
+    first = markdown.parse('# One\n\ntext\n')
+    assert markdown.render_html(first) == '<h1>One</h1>\n<p>text</p>\n'
+    assert markdown.render_html(markdown.parse('# Two\n')) == '<h1>Two</h1>\n'
+    assert markdown.render(markdown.parse(SAMPLE_PAGE)) == markdown.render(markdown.parse(SAMPLE_PAGE))
+
+
 if __name__ == '__main__':
     test_section()
\ No newline at end of file
@@ -0,0 +1,76 @@
+import os
+import pytest
+
+from .. import cache
+from .. import search
+from .. import tagsel
+from .. import tw
+from . import gitrepo
+
+
+@pytest.fixture
+def corpus(tmp_path, monkeypatch):
+    monkeypatch.setattr(tw, 'LOCAL_PATH', str(tmp_path / 'corpus'))
+    monkeypatch.setattr(cache, 'CACHE_PATH', str(tmp_path / 'cache'))
+    for name, files in {
+        'ssi-terms.wiki': {
+            'verifiable-credential.md': '## Definition\nA credential that can be verified.\n\n## Tags\n#core\n',
+            'holder.md': '## Definition\nA party that keeps verifiable credentials.\n\n'
+                         '## Notes\nSee also wallet.\n',
+            'Home.md': 'Verifiable credentials are everywhere.\n',
+        },
+        'misc-terms.wiki': {
+            'wallet.md': '## Definition\nSoftware that holds credentials.\n\n## Tags\n#core\n',
+            'verifier.md': '## Definition\nOne who checks; see [holder](holder).\n\n## Notes\nChecks stripes, like a zebra.\n',
+        },
+    }.items():
+        folder = gitrepo.init(os.path.join(tw.LOCAL_PATH, name))
+        gitrepo.commit(folder, files)
+    return tw.cloned_wikis()
+
+
+def terms(hits):
+    return [h.term for h in hits]
+
+
+def test_search_ranks_terms_first(corpus):
+    idx = search.SearchIndex()
+    assert idx.update(corpus) == 2
+    # The term itself outranks a mention in a definition; Home isn't a term.
+    assert terms(idx.search('verifiable credential')) == ['verifiable credential', 'holder']
+    hits = terms(idx.search('credential'))
+    assert hits[0] == 'verifiable credential' and sorted(hits[1:]) == ['holder', 'wallet']
+    assert terms(idx.search('wallet')) == ['wallet', 'holder']
+    assert idx.search('wallet')[0].snippet == 'Software that holds credentials.'
+    assert idx.search('wallet')[1].snippet == 'See also [wallet].'
+    # Brackets in the text aren't mistaken for the highlighting of a match.
+    assert idx.search('zebra')[0].snippet == 'Checks stripes, like a [zebra].'
+
+
+def test_search_with_tags_and_odd_queries(corpus):
+    idx = search.SearchIndex()
+    idx.update(corpus)
+    assert terms(idx.search('credential', tagsel.parse('#core and #misc'))) == ['wallet']
+    assert terms(idx.search('credential', limit=1)) == ['verifiable credential']
+    # Not valid FTS5, so it's searched as plain words.
+    assert terms(idx.search('holds-credentials)')) == ['wallet']
+
+
+def test_incremental_update(corpus, monkeypatch):
+    idx = search.SearchIndex()
+    idx.update(corpus)
+    assert idx.update(corpus) == 0
+
+    ssi = os.path.join(tw.LOCAL_PATH, 'ssi-terms.wiki')
+    gitrepo.commit(ssi, {'holder.md': None, 'issuer.md': '## Definition\nA party that issues credentials.\n'})
+    # Only the pages that changed should be read again.
+    read = []
+    extract = tw.Page._extract_data
+    monkeypatch.setattr(tw.Page, '_extract_data', lambda page: read.append(page.fname) or extract(page))
+    idx = search.SearchIndex()
+    assert idx.update(tw.cloned_wikis()) == 1
+    assert read == ['issuer.md']
+    assert terms(idx.search('party')) == ['issuer']
+
+    assert idx.update([w for w in tw.cloned_wikis() if w.repo_name == 'misc-terms.wiki']) == 1
+    assert terms(idx.search('credential')) == ['wallet']
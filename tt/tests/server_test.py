@@ -0,0 +1,67 @@
+import json
+import os
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+from .. import cache
+from .. import server
+from .. import tw
+from ..glossary import Glossary
+from . import gitrepo
+
+
+@pytest.fixture
+def glossary_server(tmp_path, monkeypatch):
+    monkeypatch.setattr(tw, 'LOCAL_PATH', str(tmp_path / 'corpus'))
+    monkeypatch.setattr(cache, 'CACHE_PATH', str(tmp_path / 'cache'))
+    monkeypatch.setattr(server, 'CHECK_INTERVAL', 0)
+    folder = gitrepo.init(os.path.join(tw.LOCAL_PATH, 'served-terms.wiki'))
+    gitrepo.commit(folder, {
+        'alpha.md': '## Definition\nThe first. Comes before [beta](beta).\n\n## Tags\n#greek\n',
+        'beta.md': '## Definition\nThe second.\n',
+        'Delta-Wing-(DW).md': '## Definition\nA triangular wing.\n',
+    })
+    g = Glossary({"sources": [{"wiki": "served-terms"}]})
+    g.sources[0].wiki.refreshed = True
+    httpd = server.GlossaryServer(g, ('127.0.0.1', 0))
+    t = threading.Thread(target=httpd.serve_forever, args=(0.05,), daemon=True)
+    t.start()
+    try:
+        yield httpd
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+def get(httpd, path):
+    url = 'http://127.0.0.1:%d%s' % (httpd.server_address[1], path)
+    with urllib.request.urlopen(url) as r:
+        return r.read().decode('utf-8')
+
+
+def test_serves_glossary_and_terms(glossary_server):
+    assert get(glossary_server, '/') == glossary_server.glossary.render()
+    assert 'title="The second."' in get(glossary_server, '/term/alpha')
+    assert json.loads(get(glossary_server, '/term/DW.json'))['term'] == 'Delta Wing (DW)'
+    terms = json.loads(get(glossary_server, '/terms.json?tags=%23greek'))
+    assert [t['fragment'] for t in terms] == ['alpha']
+    html = get(glossary_server, '/?tags=not+%23greek')
+    assert 'id="beta"' in html and 'id="alpha"' not in html
+    with pytest.raises(urllib.error.HTTPError) as e:
+        get(glossary_server, '/term/nope')
+    assert e.value.code == 404
+    with pytest.raises(urllib.error.HTTPError) as e:
+        get(glossary_server, '/?tags=%23greek+and')
+    assert e.value.code == 400
+
+
+def test_changed_pages_are_reread(glossary_server):
+    get(glossary_server, '/')
+    folder = glossary_server.glossary.sources[0].wiki.folder
+    with open(os.path.join(folder, 'beta.md'), 'wt') as f:
+        f.write('## Definition\nThe runner-up.\n')
+    assert 'title="The runner-up."' in get(glossary_server, '/term/alpha')
+    assert 'The runner-up.' in get(glossary_server, '/')
@@ -1,4 +1,5 @@
-from ..tag import normalize, edit_distance
+from ..tag import normalize, edit_distance, edit_distances, BKTree, \
+    _damerau_levenshtein_distance, _unrestricted_damerau_levenshtein_distance
 
 
 def test_normalize_forces_lower_case():
@@ -10,4 +11,72 @@ def test_normalize_forces_hyphens():
 
 
 def test_edit_distance():
-    assert edit_distance("hello-world", 'HelloWorld') == 0
\ No newline at end of file
+    assert edit_distance("hello-world", 'HelloWorld') == 0
+
+def test_bk_tree_finds_close_tags():
+    tree = BKTree(['#verifiable-credential', '#credential', '#ssi', '#did', '#dids', '#wallet'])
+    assert len(tree) == 6
+    assert tree.find('#verifiablecredentail') == [(1, '#verifiable-credential')]
+    assert tree.find('#DID') == [(0, '#did'), (1, '#dids')]
+    assert tree.find('#unrelated') == []
+
+
+def test_bk_tree_matches_brute_force():
+    import random
+    r = random.Random(42)
+    tags = set('#' + ''.join(r.choice('abcd') for i in range(r.randint(1, 7))) for j in range(300))
+    tree = BKTree(sorted(tags))
+    for query in ['#abc', '#dcba', '#aaaaaaa', '#bd']:
+        expected = sorted((edit_distance(query, t), t) for t in tags if edit_distance(query, t) <= 2)
+        assert tree.find(query, 2) == expected
+
+
+def _reference_distance(s1, s2):
+    # The original dict-based implementation, kept to check the optimized one.
+    d = {}
+    for i in range(-1, len(s1) + 1):
+        d[(i, -1)] = i + 1
+    for j in range(-1, len(s2) + 1):
+        d[(-1, j)] = j + 1
+    for i in range(len(s1)):
+        for j in range(len(s2)):
+            cost = 0 if s1[i] == s2[j] else 1
+            d[(i, j)] = min(d[(i - 1, j)] + 1, d[(i, j - 1)] + 1, d[(i - 1, j - 1)] + cost)
+            if i and j and s1[i] == s2[j - 1] and s1[i - 1] == s2[j]:
+                d[(i, j)] = min(d[(i, j)], d[i - 2, j - 2] + cost)
+    return d[len(s1) - 1, len(s2) - 1]
+
+
+def test_distance_matches_reference():
+    import random
+    r = random.Random(7)
+    for n in range(2000):
+        s1 = ''.join(r.choice('abc') for i in range(r.randint(0, 9)))
+        s2 = ''.join(r.choice('abc') for i in range(r.randint(0, 9)))
+        expected = _reference_distance(s1, s2)
+        assert _damerau_levenshtein_distance(s1, s2) == expected, (s1, s2)
+        for k in range(4):
+            assert _damerau_levenshtein_distance(s1, s2, k) == min(expected, k + 1), (s1, s2, k)
+
+
+def test_edit_distances():
+    assert edit_distances('#did', ['#DID', '#dids', '#ddi', '#wallet'], 2) == [0, 1, 1, 3]
+
+
+def test_bk_tree_handles_triangle_inequality_failure():
+    # edit_distance() says ca -> ac -> abc is 2 edits but ca -> abc is 3.
+    tree = BKTree(['#ca', '#abc'])
+    assert _unrestricted_damerau_levenshtein_distance('ca', 'abc') == 2
+    assert tree.find('#ac', 1) == [(1, '#abc'), (1, '#ca')]
+
+
+def test_unrestricted_distance_cutoff():
+    import random
+    r = random.Random(11)
+    for n in range(2000):
+        s1 = ''.join(r.choice('abc') for i in range(r.randint(0, 9)))
+        s2 = ''.join(r.choice('abc') for i in range(r.randint(0, 9)))
+        expected = _unrestricted_damerau_levenshtein_distance(s1, s2)
+        assert expected <= _damerau_levenshtein_distance(s1, s2)
+        for k in range(4):
+            assert _unrestricted_damerau_levenshtein_distance(s1, s2, k) == min(expected, k + 1), (s1, s2, k)
@@ -0,0 +1,76 @@
+import os
+import pytest
+
+from .. import cache
+from .. import glossary
+from .. import tagindex
+from .. import tagsel
+from .. import tw
+from . import gitrepo
+
+
+@pytest.fixture
+def corpus(tmp_path, monkeypatch):
+    monkeypatch.setattr(tw, 'LOCAL_PATH', str(tmp_path / 'corpus'))
+    monkeypatch.setattr(cache, 'CACHE_PATH', str(tmp_path / 'cache'))
+    for name, files in {
+        'ssi-terms.wiki': {
+            'did.md': '## Definition\nAn identifier.\n\n## Tags\n#core\n',
+            'vc.md': '## Definition\nA credential.\n\n## Tags\n#core #Deprecated\n',
+            'Home.md': 'Welcome.\n',
+        },
+        'misc-terms.wiki': {
+            'wallet.md': '## Definition\nHolds things.\n\n## Tags\n#core\n',
+        },
+    }.items():
+        folder = gitrepo.init(os.path.join(tw.LOCAL_PATH, name))
+        gitrepo.commit(folder, files)
+    return tw.cloned_wikis()
+
+
+def select(idx, expr):
+    return sorted(e.fragment for e in idx.select(tagsel.parse(expr)))
+
+
+def test_select(corpus):
+    idx = tagindex.TagIndex()
+    assert idx.update(corpus) == 4
+    assert len(idx) == 3
+    assert select(idx, '#core') == ['did', 'vc', 'wallet']
+    assert select(idx, '#ssi and not #deprecated') == ['did']
+    assert select(idx, 'not #ssi') == ['wallet']
+    assert select(idx, '#nosuchtag') == []
+
+
+def test_incremental_update(corpus):
+    idx = tagindex.TagIndex()
+    idx.update(corpus)
+    idx.save()
+
+    idx = tagindex.load()
+    assert idx.update(corpus) == 0
+    assert select(idx, '#ssi and not #deprecated') == ['did']
+
+    ssi = os.path.join(tw.LOCAL_PATH, 'ssi-terms.wiki')
+    with open(os.path.join(ssi, 'vc.md'), 'wt') as f:
+        f.write('## Definition\nA credential.\n\n## Tags\n#core\n')
+    os.remove(os.path.join(ssi, 'did.md'))
+    assert idx.update(corpus) == 2
+    assert select(idx, '#ssi and not #deprecated') == ['vc']
+    assert '#deprecated' not in idx.tags
+
+
+def test_suggest(corpus):
+    idx = tagindex.TagIndex()
+    idx.update(corpus)
+    assert idx.suggest('#deprecatd') == ['#deprecated']
+    assert idx.suggest('#core') == []
+
+
+def test_select_matches_glossary_subset(corpus):
+    idx = tagindex.TagIndex()
+    idx.update(corpus)
+    for expr in ['#deprecated', '#DEPRECATED', 'not #deprecated and #ssi']:
+        g = glossary.Glossary({"sources": [{"wiki": "ssi-terms", "subset": expr}]})
+        g.sources[0].wiki.refreshed = True
+        assert [p.fragment for p in g.pages] == select(idx, expr)
@@ -107,6 +107,7 @@ def assert_tags_match(tag_chars, expr, expected=True):
     expr = parse(expr)
     tags = make_tags(tag_chars)
     assert expr.matches(tags) == expected
+    assert compile_expr(expr)(tag_ids(tags)) == expected
 
 
 def test_match_simple():
@@ -188,3 +189,28 @@ def test_match_precedence_of_and():
     assert_tags_match("abz", "#a and #x or #b and #c", False)
     assert_tags_match("axbz", "#a and #x or #b and #c")
     assert_tags_match("abcz", "#a and #x or #b and #c")
+
+
+def test_compiled_matches_tree():
+    import itertools
+    exprs = [
+        "#a and not #a", "#a or not #a", "not (#a and #b) or #c",
+        "not (#a or not (#b and not #c)) and (#d or #a)", "#a or #b or not #c",
+        "not not (#a and #b and (#c or #d))", "(#a or #b) and (not #a or #c)",
+    ]
+    for text in exprs:
+        expr = parse(text)
+        compiled = compile_expr(expr)
+        for n in range(5):
+            for chars in itertools.combinations("abcd", n):
+                tags = make_tags(chars)
+                assert compiled(tag_ids(tags)) == expr.matches(tags), (text, chars)
+
+
+def test_tag_ids_unique_across_threads():
+    import concurrent.futures
+    tags = ['#threaded-%d' % i for i in range(2000)]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=8) as pool:
+        ids = list(pool.map(tag_id, tags))
+    assert len(set(ids)) == len(tags)
+    assert [tag_id(t) for t in tags] == ids
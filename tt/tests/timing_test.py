@@ -0,0 +1,30 @@
+from .. import git
+from .. import timing
+
+
+def test_nothing_recorded_when_disabled():
+    timing.disable()
+    with timing.stage('x'):
+        timing.count('y')
+    assert 'x' not in timing.report()['stages']
+
+
+def test_stages_and_counters(tmp_path):
+    timing.enable()
+    try:
+        with timing.stage('outer'):
+            for i in range(3):
+                with timing.stage('inner'):
+                    timing.count('things')
+            big = [0] * 100000
+            git.run_git(['init', '-q', str(tmp_path)])
+        r = timing.report()
+    finally:
+        timing.disable()
+    assert r['stages']['inner']['calls'] == 3
+    assert r['stages']['outer']['calls'] == 1
+    assert r['stages']['outer']['subprocesses'] == 1
+    assert r['stages']['inner']['subprocesses'] == 0
+    assert r['stages']['outer']['peak_bytes'] >= 800000
+    assert r['counters']['things'] == 3
+    assert 'outer' in timing.format_report(r)
@@ -2,7 +2,9 @@ import os
 import pytest
 import tempfile
 
+from .. import cache
 from .. import tw
+from . import gitrepo
 
 SAMPLE_PAGE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sample-page.md')
 
@@ -28,10 +30,11 @@ def test_git_code_parseable():
 @pytest.fixture
 def scratch_space():
     x = tempfile.TemporaryDirectory()
-    old_local_path = tw.LOCAL_PATH
-    tw.LOCAL_PATH = x.name
+    old_local_path, old_cache_path = tw.LOCAL_PATH, cache.CACHE_PATH
+    tw.LOCAL_PATH = os.path.join(x.name, 'corpus')
+    cache.CACHE_PATH = os.path.join(x.name, 'cache')
     yield x
-    tw.LOCAL_PATH = old_local_path
+    tw.LOCAL_PATH, cache.CACHE_PATH = old_local_path, old_cache_path
     x.cleanup()
 
 
@@ -66,9 +69,86 @@ def test_page():
     assert "#tag1" in page.tags
 
 
+def test_page_is_compact():
+    page = tw.Page('/x/Delta-Wing-(DW).md')
+    assert not hasattr(page, '__dict__')
+    assert page.fragment == 'delta-wing-dw'
+    assert page.acronym == 'DW'
+    assert page.term_minus_acronym == 'Delta Wing'
+    page.data = {'sections': {'definition': 'x'}, 'tags': ['#b', '#a']}
+    assert page.tags == ('#a', '#b')
+    assert page.tags is page.tags
+
+
 def test_hovertext():
     page = tw.Page(SAMPLE_PAGE)
     ht = page.hovertext
     assert ht.startswith('A common context')
     assert ht.endswith('associated terms.')
     assert '<' not in ht
+
+
+def test_page_history_from_wiki(scratch_space):
+    x = tw.TermsWiki('history-terms')
+    gitrepo.init(x.folder)
+    gitrepo.commit(x.folder, {'foo.md': '## Definition\nA foo.\n'}, author='Alice', timestamp=1000)
+    gitrepo.commit(x.folder, {'foo.md': '## Definition\nA better foo.\n'}, author='Bob', timestamp=2000)
+    gitrepo.commit(x.folder, {'foo.md': '## Definition\nThe best foo.\n'}, author='Alice', timestamp=3000)
+    x.refreshed = True
+    page = [p for p in x.pages][0]
+    assert page.version == 3
+    assert page.creation_date == 1000
+    assert page.lastmod_date == 3000
+    assert page.contributors == ['Alice', 'Bob']
+    assert page.history == tw.get_history(page.path)
+
+
+FOO_PAGE = """## Definition
+A foo is like a [bar](bar). It isn't a [baz](baz@other-glossary).
+
+## Tags
+#x #y
+"""
+
+
+def test_page_data(scratch_space):
+    x = tw.TermsWiki('data-terms')
+    gitrepo.init(x.folder)
+    gitrepo.commit(x.folder, {'foo.md': FOO_PAGE})
+    x.refreshed = True
+    page = [p for p in x.pages][0]
+    assert page.is_term
+    assert page.tags == ('#data', '#x', '#y')
+    assert page.hovertext == 'A foo is like a bar.'
+    assert page.links == ['bar']
+    assert '<a href="#bar">bar</a>' in page.definition_html
+    assert 'https://trustoverip.github.io/other-glossary/glossary.html#baz' in page.definition_html
+
+
+def test_page_cache(scratch_space, monkeypatch):
+    parsed = []
+    parse = tw.markdown.parse
+    monkeypatch.setattr(tw.markdown, 'parse', lambda text: parsed.append(text) or parse(text))
+    x = tw.TermsWiki('cached-terms')
+    gitrepo.init(x.folder)
+    gitrepo.commit(x.folder, {'foo.md': FOO_PAGE, 'bar.md': '## Definition\nA bar.\n'})
+    x.refreshed = True
+    before = {p.fname: p.data for p in x.pages}
+    assert len(parsed) == 2
+
+    # A new wiki object shouldn't need to parse anything.
+    y = tw.TermsWiki('cached-terms')
+    y.refreshed = True
+    pages = [p for p in y.pages]
+    assert {p.fname: p.data for p in pages} == before
+    assert len(parsed) == 2
+
+    # ...until a page changes.
+    with open(os.path.join(x.folder, 'bar.md'), 'at') as f:
+        f.write('\n## Tags\n#z\n')
+    z = tw.TermsWiki('cached-terms')
+    z.refreshed = True
+    pages = {p.fname: p for p in z.pages if p.is_term}
+    assert len(parsed) == 3
+    assert parsed[-1].endswith('#z\n')
+    assert '#z' in pages['bar.md'].tags
@@ -0,0 +1,141 @@
+"""
+Lightweight instrumentation for finding out where the time goes in a glossary
+build. Code marks interesting stages like this:
+
+    with timing.stage('Page.ast'):
+        ...
+
+and counts interesting events with timing.count('...'). Nothing is recorded
+unless enable() has been called; until then, both cost about as much as an
+empty function call.
+
+For each stage we record how often it ran, its total wall time, how many
+subprocesses it started and the peak memory allocated by python while it ran.
+Nested stages are included in the numbers of the stages around them. (When
+stages run in several threads at once, subprocess counts and peaks can be
+credited to whichever of them is running.)
+"""
+import json
+import threading
+import time
+import tracemalloc
+
+enabled = False
+_stages = {}
+_counters = {}
+_lock = threading.Lock()
+# Stages can run in several threads at once (sources are refreshed in parallel),
+# so each thread has its own stack of the stages it's inside.
+_local = threading.local()
+
+
+def _stack():
+    try:
+        return _local.stack
+    except AttributeError:
+        _local.stack = []
+        return _local.stack
+
+
+class _NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage:
+    def __init__(self, name):
+        self.name = name
+        self.peak = 0
+
+    def __enter__(self):
+        # Peak memory is tracked by resetting tracemalloc's peak whenever a stage
+        # starts, so credit the stages we're inside with the peak so far first.
+        peak = tracemalloc.get_traced_memory()[1]
+        stack = _stack()
+        for outer in stack:
+            outer.peak = max(outer.peak, peak)
+        tracemalloc.reset_peak()
+        stack.append(self)
+        self.subprocesses = _counters.get('subprocesses', 0)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        elapsed = time.perf_counter() - self.start
+        self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+        stack = _stack()
+        stack.pop()
+        if stack:
+            stack[-1].peak = max(stack[-1].peak, self.peak)
+        with _lock:
+            record = _stages.get(self.name)
+            if record is None:
+                record = _stages[self.name] = {'calls': 0, 'seconds': 0.0, 'subprocesses': 0, 'peak_bytes': 0}
+            record['calls'] += 1
+            record['seconds'] += elapsed
+            record['subprocesses'] += _counters.get('subprocesses', 0) - self.subprocesses
+            record['peak_bytes'] = max(record['peak_bytes'], self.peak)
+
+
+def stage(name):
+    """
+    Return a context manager that records time, subprocesses and memory under name.
+    """
+    return _Stage(name) if enabled else _NULL_STAGE
+
+
+def count(name, n=1):
+    if enabled:
+        with _lock:
+            _counters[name] = _counters.get(name, 0) + n
+
+
+def enable():
+    """
+    Start recording, forgetting anything recorded before. Tracing memory makes
+    python noticeably slower, so only do this when a profile has been asked for.
+    """
+    global enabled
+    enabled = True
+    _stages.clear()
+    _counters.clear()
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def disable():
+    global enabled
+    enabled = False
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def report():
+    """
+    Return everything recorded so far, as a json-friendly dict.
+    """
+    return {'stages': {name: dict(record) for name, record in _stages.items()},
+            'counters': dict(_counters)}
+
+
+def format_report(r):
+    lines = ['%-24s %8s %10s %9s %9s' % ('stage', 'calls', 'seconds', 'subprocs', 'peak MB')]
+    for name, record in sorted(r['stages'].items(), key=lambda item: -item[1]['seconds']):
+        lines.append('%-24s %8d %10.3f %9d %9.1f' % (
+            name, record['calls'], record['seconds'], record['subprocesses'], record['peak_bytes'] / 1e6))
+    if r['counters']:
+        lines.append('')
+        for name, n in sorted(r['counters'].items()):
+            lines.append('%-24s %8d' % (name, n))
+    return '\n'.join(lines) + '\n'
+
+
+def write_report(path):
+    with open(path, 'wt') as f:
+        json.dump(report(), f, indent=2)
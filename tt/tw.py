@@ -1,8 +1,12 @@
+import sys
 import weakref
 
 from .tag import normalize
 from .git import *
+from . import cache
+from . import manifest
 from . import markdown
+from . import timing
 
 GIT_REPO_PAT = re.compile('git@github.com:([^/]+)/(.*?)(?:[.]wiki)?[.]git$')
 HTTPS_REPO_PAT = re.compile('https://github.com/([^/]+)/(.*?)(?:[.]wiki)?[.]git$')
@@ -12,10 +16,51 @@ WIKI_SUFFIX = '.wiki'
 SAMPLE_TERMS_WIKI_REPO = 'git@github.com:dhh1128/scifi-terms.git'
 TAGS_SPLITTER = re.compile(r'[* \t\r\n,]+')
 ACRONYM_PAT = re.compile(r'(.*?)\s*\(([^)]+)\)$')
+WIKI_PAGE_LINK_PAT = re.compile(r'[a-z0-9]+(-[a-z0-9]+)*$', re.IGNORECASE)
+SHORT_EXTERNAL_GLOSSARY_LINK_PAT = re.compile(r'([a-z0-9]+(?:-[a-z0-9]+)*)@([a-z0-9]+(?:-[a-z0-9]+)*)$', re.IGNORECASE)
+# The git settings a wiki has when its config leaves them out; see TermsWiki.configure().
+GIT_DEFAULTS = {'filter': None, 'reference': None, 'refresh': 'pull'}
+
+
+def fix_link_dest(link):
+    """
+    Rewrite the destination of a hyperlink so it works in a glossary. Links to
+    other pages in the same wiki become links to fragments; links like
+    term@some-glossary become links into that glossary on trustoverip.github.io.
+    Return the fragment if the link pointed to another page in the wiki.
+    """
+    if WIKI_PAGE_LINK_PAT.match(link.dest):
+        fragment = link.dest
+        link.dest = '#' + fragment
+        return fragment
+    m = SHORT_EXTERNAL_GLOSSARY_LINK_PAT.match(link.dest)
+    if m:
+        link.dest = 'https://trustoverip.github.io/' + m.group(2) + '/glossary.html#' + m.group(1)
+
+
+def _describe(value):
+    return 'unset' if value is None else '"%s"' % value
+
+
+def extract_page_data(path, text=None):
+    """
+    Parse the page at path (or text, if given, as if it were that page) and return
+    its data (see Page.data). This is a plain function so it can run in another
+    process.
+    """
+    page = Page(path)
+    if text is not None:
+        page._ast = markdown.parse(text)
+    return page._extract_data()
 
 
 class TermsWiki:
-    def __init__(self, which):
+    def __init__(self, which, rev=None):
+        """
+        Normally a wiki's pages are the files in its local clone. Given a rev (a
+        tag, say, or a commit hash), they're read from git as they were in that
+        commit instead, without checking anything out.
+        """
         m = GIT_REPO_PAT.match(which)
         if not m:
             m = HTTPS_REPO_PAT.match(which)
@@ -27,13 +72,32 @@ class TermsWiki:
             name = which
         if name.endswith(WIKI_SUFFIX):
             self.repo_name = name
-            self.code_repo_name = name[:-1 * WIKI_SUFFIX.len()]
+            self.code_repo_name = name[:-1 * len(WIKI_SUFFIX)]
         else:
             self.code_repo_name = name
             self.repo_name = name + WIKI_SUFFIX
         m = TAG_PAT.match(self.code_repo_name)
         self.tag = normalize(m.group(1) if m else self.code_repo_name)
         self.refreshed = False
+        # Turn this off to always read pages from the files.
+        self.use_manifest = True
+        self.rev = rev
+        self._commit = None
+        self._blobs = None
+        # How the local clone is made and kept up to date; see configure().
+        self._git_cfg = None
+        self.clone_filter = None
+        self.reference = None
+        self.fetch_only = False
+        self._pages = None
+        self._histories = None
+        # Warnings already given about the wiki's pages, so that glossaries
+        # sharing the wiki don't repeat them.
+        self.warnings = set()
+        # Pages read from git are cached by blob, so each version of a page is
+        # only parsed once, whichever revisions it's in.
+        self.cache = cache.PageCache(self.repo_name + ('.blobs' if rev else ''))
+        self.manifest = manifest.Manifest(self.repo_name)
 
     @property
     def code_repo_url(self):
@@ -51,34 +115,295 @@ class TermsWiki:
     def is_cloned(self):
         return os.path.isdir(self.folder)
 
+    def configure(self, cfg):
+        """
+        Choose how the wiki is cloned and refreshed, from a dict like the "git"
+        section of a glossary config:
+
+            filter      make a partial clone, e.g. "blob:none"
+            reference   a folder of mirrors (named like ctwg-terms.wiki.git) to
+                        borrow objects from when cloning, if this wiki has one
+            refresh     "pull" (the default), or "fetch" to fetch and move to
+                        the remote's tip without merging
+
+        A wiki shared by several glossaries is configured by each of them. They
+        must all want the same settings, leaving one out being the same as
+        giving its default, so that no glossary changes how another's wiki is
+        cloned or refreshed.
+        """
+        for name, value in cfg.items():
+            if name not in GIT_DEFAULTS:
+                raise Exception('Unknown git setting "%s".' % name)
+            if name == 'refresh' and value not in ('pull', 'fetch'):
+                raise Exception('Unknown refresh mode "%s"; expected "pull" or "fetch".' % value)
+        settings = dict(GIT_DEFAULTS, **cfg)
+        if self._git_cfg is not None:
+            for name in sorted(settings):
+                if settings[name] != self._git_cfg[name]:
+                    raise Exception('Conflicting git settings for %s: "%s" is both %s and %s.' % (
+                        self.repo_name, name, _describe(self._git_cfg[name]), _describe(settings[name])))
+        self._git_cfg = settings
+        self.clone_filter = settings['filter']
+        self.reference = settings['reference']
+        self.fetch_only = settings['refresh'] == 'fetch'
+
     def refresh(self, force=False):
         if force or (not self.refreshed):
             self.refreshed = True
-            if not self.is_cloned:
-                clone(self.repo_url, self.folder)
-            else:
-                pull(self.folder)
+            commit = None
+            with timing.stage('TermsWiki.refresh'):
+                if not self.is_cloned:
+                    reference = None
+                    if self.reference:
+                        reference = os.path.join(os.path.expanduser(self.reference), self.repo_name + '.git')
+                    clone(self.repo_url, self.folder, filter=self.clone_filter, reference=reference)
+                elif self.rev:
+                    # A revision that's already here (a release tag, say) won't
+                    # have moved, so only go looking for one that isn't.
+                    commit = resolve(self.folder, self.rev)
+                    if commit is None:
+                        fetch_refs(self.folder)
+                elif remote_head(self.folder) == get_head(self.folder):
+                    # Asking where the remote is costs much less than a pull,
+                    # and most of the time, nothing has changed.
+                    timing.count('refreshes skipped')
+                    return
+                elif self.fetch_only:
+                    fetch(self.folder)
+                else:
+                    pull(self.folder)
+            self._commit = commit
+            self._pages = None
+            self.forget_histories()
+            # Fail now, rather than when the pages are read, if rev doesn't exist.
+            self.commit
+
+    @property
+    def commit(self):
+        """
+        The hash of the commit that rev names, or None if the wiki has no rev.
+        """
+        if self.rev and self._commit is None:
+            self._commit = resolve(self.folder, self.rev)
+            if self._commit is None:
+                raise Exception('%s has no revision %s.' % (self.repo_name, self.rev))
+        return self._commit
+
+    def read_blob(self, blob):
+        """
+        Return the text of a blob in the wiki's repo.
+        """
+        if self._blobs is None:
+            self._blobs = BlobReader(self.folder)
+            # However the wiki is let go of, don't leave the process behind.
+            self._close_blobs = weakref.finalize(self, self._blobs.close)
+        # Decode the way open() in text mode would.
+        return self._blobs.read(blob).decode('utf-8').replace('\r\n', '\n').replace('\r', '\n')
+
+    def close(self):
+        """
+        Stop the git process reading blobs, if there is one. (Another is started
+        if more are needed.)
+        """
+        if self._blobs is not None:
+            self._close_blobs()
+            self._blobs = None
+
+    def forget_histories(self):
+        """
+        Make the next request for a history ask git again, because HEAD has moved.
+        """
+        self._histories = None
+
+    @property
+    def histories(self):
+        """
+        Map each file in the wiki (relative path) to its history. The whole map
+        is built with a single git command the first time it's needed.
+        """
+        if self._histories is None:
+            try:
+                self._histories = get_histories(self.folder, self.commit)
+            except:
+                self._histories = {}
+        return self._histories
+
+    def rel_path(self, path):
+        # Pages' paths are absolute and normalized, so usually this is just a
+        # matter of dropping the folder, which is much cheaper than relpath().
+        prefix = self.folder + os.sep
+        if path.startswith(prefix):
+            return path[len(prefix):].replace(os.sep, '/')
+        return os.path.relpath(path, self.folder).replace(os.sep, '/')
+
+    def history_of(self, path):
+        return self.histories.get(self.rel_path(path), [])
 
     @property
     def pages(self):
+        """
+        Every page in the wiki, refreshing it first if it hasn't been. The list is
+        kept until the wiki is refreshed again, so glossaries that share the wiki
+        share its pages, and each page is only parsed once.
+        """
         self.refresh()
+        if self._pages is not None:
+            return self._pages
+        # Manifests only describe HEAD.
+        return self._keep((self.use_manifest and not self.rev and self.manifest_pages()) or self.walk())
+
+    def _keep(self, pages):
+        kept = []
+        for page in pages:
+            kept.append(page)
+            yield page
+        # Only keep the list once it's complete.
+        self._pages = kept
+
+    def manifest_pages(self):
+        """
+        Return the term pages listed in the wiki's manifest, or None if there is
+        no manifest or the wiki's HEAD has moved since it was written. Pages whose
+        files have been edited (or were, when the manifest was written) are read
+        from the files instead.
+        """
+        with timing.stage('TermsWiki.manifest'):
+            loaded = self.manifest.load(get_head(self.folder))
+            if loaded is None:
+                timing.count('manifest misses')
+                return None
+            timing.count('manifest hits')
+            entries, unlisted = loaded
+            edited = get_dirty_files(self.folder).union(unlisted)
+            pages = [Page.from_manifest(entry, self) for entry in entries if entry[0] not in edited]
+            for rel_path in sorted(edited):
+                path = os.path.join(self.folder, rel_path)
+                if rel_path.endswith('.md') and os.path.isfile(path):
+                    pages.append(Page(path, self))
+            return pages
+
+    def write_manifest(self):
+        """
+        Record every term page in the local clone, as of its current HEAD, in the
+        wiki's manifest. Return how many term pages there were.
+        """
+        head = get_head(self.folder)
+        # Edited pages aren't as they were at HEAD, so leave them out.
+        edited = get_dirty_files(self.folder)
+        entries = [page.to_manifest() for page in self.walk()
+                   if self.rel_path(page.path) not in edited and page.is_term]
+        self.manifest.save(head, entries, sorted(edited))
+        return len(entries)
+
+    def page_paths(self):
+        """
+        Return the path of every page in the local clone of the wiki. Anything
+        that isn't a regular file, like the dangling links some editors use as
+        locks, is left out.
+        """
+        paths = []
         for root, folders, files in os.walk(self.folder):
             if '.git' in folders:
                 folders.remove('.git')
             for f in files:
                 if f.endswith('.md'):
-                    yield Page(os.path.join(root, f), self)
+                    path = os.path.join(root, f)
+                    if os.path.isfile(path):
+                        paths.append(path)
+        return paths
+
+    def walk(self):
+        """
+        Yield every page in the local clone of the wiki (or, if the wiki has a rev,
+        in that commit), without refreshing it first.
+        """
+        # Find all the pages up front, so walking the folder can be timed apart
+        # from whatever the caller does with each page.
+        with timing.stage('TermsWiki.pages'):
+            if self.rev:
+                pages = [Page(os.path.join(self.folder, rel_path), self, blob)
+                         for rel_path, blob in list_blobs(self.folder, self.commit) if rel_path.endswith('.md')]
+            else:
+                pages = [Page(path, self) for path in self.page_paths()]
+        seen = set()
+        for page in pages:
+            seen.add(self.rel_path(page.path))
+            yield page
+        # Only reached once the caller has seen every page, so anything they
+        # extracted is ready to be saved for next time. (Blobs from other
+        # revisions are worth keeping.)
+        if not self.rev:
+            self.cache.prune(seen)
+        self.cache.save()
+
+
+def cloned_wikis():
+    """
+    Return a TermsWiki for each wiki that has been cloned into the local corpus.
+    """
+    wikis = []
+    if os.path.isdir(LOCAL_PATH):
+        for name in sorted(os.listdir(LOCAL_PATH)):
+            if os.path.isdir(os.path.join(LOCAL_PATH, name, '.git')):
+                wikis.append(TermsWiki(name))
+    return wikis
 
 
 class Page:
-    def __init__(self, path, wiki=None):
+    # A merged corpus can hold tens of thousands of pages, so pages are kept
+    # small: no __dict__, and everything derived from the term is worked out
+    # once, the first time it's asked for.
+    __slots__ = ('_wiki', 'path', 'blob', 'term', '_ast', '_sections', '_data', '_cache_key', '_history',
+                 '_fragment', '_acronym', '_term_minus_acronym', '_tags')
+
+    def __init__(self, path, wiki=None, blob=None):
+        """
+        A page whose content comes from git has the hash of its blob; otherwise,
+        it's read from the file at path.
+        """
         self._wiki = weakref.ref(wiki) if wiki else None
         self.path = os.path.normpath(os.path.abspath(path))
+        self.blob = blob
         self._ast = None
         self._sections = None
         self.term = self.fname[:-3].replace('-', ' ')
-        self._hovertext = None
+        self._data = None
+        self._cache_key = None
         self._history = None
+        self._fragment = None
+        self._acronym = None
+        self._term_minus_acronym = None
+        self._tags = None
+
+    @classmethod
+    def from_manifest(cls, entry, wiki):
+        """
+        Recreate a term page from an entry in its wiki's manifest, without
+        touching the file or its history in git.
+        """
+        rel_path, term, fragment, acronym, tags, hovertext, definition, links, sections, history = entry
+        page = cls(os.path.join(wiki.folder, rel_path), wiki)
+        page.term = term
+        page._fragment = fragment
+        page._acronym = acronym
+        page._term_minus_acronym = ACRONYM_PAT.match(term).group(1) if acronym else term
+        # Only the names of the sections are kept; nothing uses their text once
+        # the rest of the data has been extracted.
+        page._data = {
+            'sections': dict.fromkeys(sections, ''),
+            'tags': tags,
+            'hovertext': hovertext,
+            'definition': definition,
+            'links': links,
+        }
+        page._history = [tuple(event) for event in history]
+        return page
+
+    def to_manifest(self):
+        w = self.wiki
+        return [w.rel_path(self.path), self.term, self.fragment, self.acronym, self.data['tags'],
+                self.hovertext, self.definition, self.links, list(self.data['sections']),
+                self.history]
 
     @property
     def wiki(self):
@@ -86,17 +411,27 @@ class Page:
 
     @property
     def is_term(self):
-        return self.get_section_by_fragment('definition') or self.get_section_by_fragment('see')
+        sections = self.data['sections']
+        return 'definition' in sections or 'see' in sections
+
+    def _split_acronym(self):
+        m = ACRONYM_PAT.match(self.term)
+        if m:
+            self._term_minus_acronym, self._acronym = m.group(1), m.group(2)
+        else:
+            self._term_minus_acronym = self.term
 
     @property
     def acronym(self):
-        m = ACRONYM_PAT.match(self.term)
-        return m.group(2) if m else None
+        if self._term_minus_acronym is None:
+            self._split_acronym()
+        return self._acronym
 
     @property
     def term_minus_acronym(self):
-        m = ACRONYM_PAT.match(self.term)
-        return m.group(1) if m else self.term
+        if self._term_minus_acronym is None:
+            self._split_acronym()
+        return self._term_minus_acronym
 
     @property
     def fname(self):
@@ -104,83 +439,193 @@ class Page:
 
     @property
     def fragment(self):
-        return markdown.title_to_fragment(self.term)
+        if self._fragment is None:
+            self._fragment = markdown.title_to_fragment(self.term)
+        return self._fragment
 
     @property
     def hovertext(self):
-        if self._hovertext is None:
-            self._hovertext = ""
-            dfn = self.get_section_by_fragment('definition')
-            if dfn:
+        return self.data['hovertext']
+
+    @property
+    def definition(self):
+        """
+        The definition (or "see" section) of the term, as html with the links to
+        other pages in the wiki kept apart (see markdown.split_definition()). Their
+        hover text depends on which glossary the page ends up in.
+        """
+        return self.data['definition']
+
+    @property
+    def definition_html(self):
+        """
+        The definition as html. Links to other pages in the wiki point to #fragment
+        but have no hover text.
+        """
+        return markdown.join_definition(self.definition, {})
+
+    @property
+    def links(self):
+        """
+        Fragments of the other pages in the wiki that this page links to.
+        """
+        return self.data['links']
+
+    @property
+    def data(self):
+        """
+        Everything a glossary needs from this page's markdown. When the page belongs
+        to a wiki, this comes from the wiki's page cache unless the file has changed
+        since it was last parsed.
+        """
+        if self._data is None and not self.load_cached_data():
+            with timing.stage('Page.data'):
+                self.data = self._extract_data()
+            # Everything needed from the parsed page is in its data now; don't
+            # keep every page's syntax tree alive. (It's parsed again if asked for.)
+            self._ast = None
+            self._sections = None
+        return self._data
+
+    @data.setter
+    def data(self, value):
+        self._data = value
+        self._tags = None
+        w = self.wiki
+        if w:
+            w.cache.put(self.blob or w.rel_path(self.path), self._cache_key, value)
+
+    @property
+    def file_key(self):
+        """
+        The fingerprint (see cache.file_key) the file had when this page's data
+        was loaded, or None if the data didn't come from the file. (For a page
+        read from git, it's the blob's hash.)
+        """
+        return self._cache_key
+
+    def load_cached_data(self):
+        """
+        Load this page's data from its wiki's page cache. Return False if it isn't
+        cached or the file has changed since. (A page that already has its data,
+        say from a manifest, keeps it.)
+        """
+        if self._data is not None:
+            return True
+        w = self.wiki
+        if w:
+            if self.blob:
+                # A blob's content can't change, so its hash is its fingerprint.
+                self._cache_key = self.blob
+                self._data = w.cache.get(self.blob, self.blob)
+            else:
+                # Fingerprint the file before it's parsed, so a change made while
+                # parsing makes the cached copy stale rather than wrong.
+                self._cache_key = cache.file_key(self.path)
+                self._data = w.cache.get(w.rel_path(self.path), self._cache_key)
+            timing.count('page cache hits' if self._data is not None else 'page cache misses')
+        return self._data is not None
+
+    def _extract_data(self):
+        links = []
+        for link in markdown.walk_hyperlinks(self.ast):
+            fragment = fix_link_dest(link)
+            if fragment and fragment not in links:
+                links.append(fragment)
+        sections = {}
+        for fragment, item in self.sections.by_fragment.items():
+            sections[fragment] = item.text
+        hovertext = ""
+        definition = []
+        dfn = self.get_section_by_fragment('definition') or self.get_section_by_fragment('see')
+        if dfn:
+            definition = markdown.split_definition(dfn.content, links)
+            if dfn.fragment == 'definition':
                 for child in dfn.children:
                     if type(child) is markdown.marko.block.Paragraph:
-                        self._hovertext = markdown.make_hovertext(child)
+                        hovertext = markdown.make_hovertext(child)
                         break
-        return self._hovertext
+        tags = []
+        if 'tags' in sections:
+            term_specific_tags = TAGS_SPLITTER.sub(' ', sections['tags']).strip()
+            if term_specific_tags:
+                tags = term_specific_tags.split(' ')
+        return {
+            'sections': sections,
+            'tags': tags,
+            'hovertext': hovertext,
+            'definition': definition,
+            'links': links,
+        }
 
     def get_section_by_fragment(self, fragment):
-        for item in self.sections:
-            h = item.heading
-            if h:
-                if item.fragment == fragment:
-                    return item
+        return self.sections.by_fragment.get(fragment)
 
     @property
     def tags(self):
-        x = []
-        w = self.wiki
-        if w:
-            x.append(w.tag)
-        ts = self.get_section_by_fragment('tags')
-        if ts:
-            term_specific_tags = TAGS_SPLITTER.sub(' ', ts.text).strip()
-            if term_specific_tags:
-                x += term_specific_tags.split(' ')
-        x.sort()
-        return x
+        """
+        The page's tags, sorted. Tags are interned, since the same few are shared
+        by many pages.
+        """
+        if self._tags is None:
+            x = [sys.intern(t) for t in self.data['tags']]
+            w = self.wiki
+            if w:
+                x.append(sys.intern(w.tag))
+            x.sort()
+            self._tags = tuple(x)
+        return self._tags
+
+    def read(self):
+        """
+        Return the page's markdown, from git if the page has a blob, else from its file.
+        """
+        if self.blob:
+            return self.wiki.read_blob(self.blob)
+        with open(self.path, 'rt') as f:
+            return f.read()
 
     @property
     def ast(self):
         if self._ast is None:
-            with open(self.path, 'rt') as f:
-                self._ast = markdown.parse(f.read())
+            with timing.stage('Page.ast'):
+                self._ast = markdown.parse(self.read())
         return self._ast
 
     @property
     def history(self):
         if self._history is None:
-            try:
-                self._history = get_history(self.path)
-            except:
-                self._history = []
+            w = self.wiki
+            with timing.stage('Page.history'):
+                try:
+                    self._history = w.history_of(self.path) if w else get_history(self.path)
+                except:
+                    self._history = []
         return self._history
 
     @property
     def version(self):
-        return len(self._history) if self.history else 0
+        return len(self.history)
 
     @property
     def hash(self):
-        return self._history[0][:7] if self.history else 0
+        return self.history[0][0][:7] if self.history else 0
 
     @property
     def creation_date(self):
         if self.history:
-            return int(self._history[-1][self._history[-1].rfind(',') + 1:])
+            return self.history[-1][2]
 
     @property
     def lastmod_date(self):
         if self.history:
-            return int(self._history[0][self._history[0].rfind(',') + 1:])
+            return self.history[0][2]
 
     @property
     def contributors(self):
         if self.history:
             c = []
-            for event in self._history:
-                i = event.find(',')
-                j = event.rfind(',')
-                person = event[i+1:j]
+            for hash, person, timestamp in self.history:
                 if person not in c:
                     c.append(person)
             return c